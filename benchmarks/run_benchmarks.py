@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+from contextlib import redirect_stdout
+
+# The game modules are plain scripts at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import game
+import offer
+from clock import VirtualClock, InlineScheduler
+from rate_limit import RateLimiter
+from rtt import RttTracker
+from simulation import SimulatedClient
+
+"""
+Micro-benchmarks for the hot functions of the trivia game server.
+
+Runs without a network: sockets are replaced by the in-memory clients of simulation.py and
+statistics are read from synthetic stats.txt histories written to a temporary directory.
+
+Benchmarks:
+1. pick_a_question and pick_questions.
+2. add_to_stats, appending one game to a statistics file.
+3. read_stats, over synthetic histories of 10^3 games and up (see --max-exponent).
+4. Rendering of the messages of trivia_game, and a whole game against simulated players.
+5. Building and parsing the UDP offer packet.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --output new.json --compare results.json --threshold 0.2
+
+With --compare, the script exits with status 1 if any benchmark got slower than the baseline
+by more than the threshold (0.2 = 20%).
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+
+def write_stats_history(path, number_of_games, seed=0):
+    """
+    Writes a synthetic statistics file in the format of game.add_to_stats.
+
+    Parameters:
+    - path (str): The file to write.
+    - number_of_games (int): The number of games in the history.
+    - seed (int): Seed for the random number generator, so every run reads the same history.
+    """
+    rng = random.Random(seed)
+    questions = [trivia_question["question"] for trivia_question in game.TRIVIA_QUESTIONS]
+    characters = ["Y", "T", "1", "N", "F", "0", "e"]
+    with open(path, "w") as file:
+        lines = []
+        for i in range(number_of_games):
+            question = rng.choice(questions)
+            number_of_players = rng.randint(2, 6)
+            lines.append(f"question that was asked:{question}")
+            if rng.random() < 0.2:
+                lines.append(f"a question nobody managed to answer:{question}")
+            lines.append(f"number of players:{number_of_players}")
+            for j in range(rng.randint(1, number_of_players)):
+                lines.append(rng.choice(characters))
+            if len(lines) >= 100000:
+                file.write("\n".join(lines) + "\n")
+                lines = []
+        if lines:
+            file.write("\n".join(lines) + "\n")
+
+
+def measure(function, repeat):
+    """
+    Times a function with timeit, calling it enough times per run for the run to last at least 0.2 seconds.
+
+    Returns:
+    - result (dict): The best and the median time of a call over the runs, in seconds, and the calls per run.
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    runs = [elapsed] + timer.repeat(repeat=repeat - 1, number=number)
+    return {
+        "seconds_per_call": min(runs) / number,
+        "median_seconds_per_call": statistics.median(runs) / number,
+        "calls_per_run": number,
+        "runs": repeat,
+    }
+
+
+def play_game(number_of_players, stats_path, seed):
+    """
+    Plays a whole trivia game against simulated players that never drop out or type invalid input.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    clock = VirtualClock()
+    client_sockets = {f"player-{i + 1}": SimulatedClient(f"player-{i + 1}", clock, rng, invalid_rate=0, dropout_rate=0)
+                      for i in range(number_of_players)}
+    for client in client_sockets.values():
+        client.name_sent = True
+    open(stats_path, "w").close()
+    game.trivia_game(client_sockets, InlineScheduler(clock, rng), stats_path, RateLimiter(clock), 1,
+                     RttTracker(clock))
+
+
+def benchmarks(directory, max_exponent, name_filter=None):
+    """
+    Returns: (name, function) tuples for every benchmark, or only for those whose name contains name_filter.
+    """
+    random.seed(0)
+    stats_path = os.path.join(directory, "stats.txt")
+    players = {f"player-{i + 1}": None for i in range(100)}
+    cases = [
+        ("pick_a_question", game.pick_a_question),
+        ("pick_questions[10]", lambda: game.pick_questions(10)),
+        ("add_to_stats", lambda: game.add_to_stats(4, True, "Einstein was a vegetarian.", ["T", "N", "e", "1"],
+                                                   stats_path)),
+    ]
+    for exponent in range(3, max_exponent + 1):
+        name = f"read_stats[1e{exponent} games]"
+        if name_filter is not None and name_filter not in name:
+            # Large histories take a while to write, skip them when they are not needed
+            continue
+        history_path = os.path.join(directory, f"stats_1e{exponent}.txt")
+        write_stats_history(history_path, 10 ** exponent)
+        cases.append((name, lambda history_path=history_path: game.read_stats(history_path)))
+    questions = game.pick_questions(10)
+    cases += [
+        ("welcome_message[4 players]", lambda: game.welcome_message(dict(list(players.items())[:4]))),
+        ("welcome_message[100 players]", lambda: game.welcome_message(players)),
+        ("next_round_message[100 players]",
+         lambda: game.next_round_message(players, 2, "Einstein was a vegetarian.", False)),
+        ("batch_message[10 questions]", lambda: game.batch_message(questions, 1)),
+        ("trivia_game[4 simulated players]", lambda: play_game(4, os.path.join(directory, "game_stats.txt"), 0)),
+        ("build_offer_packet", lambda: offer.build_offer_packet("TONGUE", "192.168.1.10", 54321)),
+    ]
+    packet = offer.build_offer_packet("TONGUE", "192.168.1.10", 54321)
+    cases.append(("parse_offer_packet", lambda: offer.parse_offer_packet(packet)))
+    return [(name, function) for name, function in cases if name_filter is None or name_filter in name]
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a baseline.
+
+    Returns:
+    - regressions (list): The names of the benchmarks more than threshold slower than in the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name}: not in the baseline")
+            continue
+        ratio = result["seconds_per_call"] / baseline[name]["seconds_per_call"]
+        status = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{name}: {ratio:.2f}x the baseline - {status}")
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the trivia game server.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown against the baseline that counts as a regression")
+    parser.add_argument("--max-exponent", type=int, default=5,
+                        help="largest statistics history for read_stats, as a power of 10 games (up to 7)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs per benchmark")
+    parser.add_argument("--filter", default=None, help="only run the benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        for name, function in benchmarks(directory, args.max_exponent, args.filter):
+            # The game functions print the messages they send
+            with redirect_stdout(devnull):
+                results[name] = measure(function, args.repeat)
+            print(f"{name}: {results[name]['seconds_per_call'] * 1e6:.2f} us per call")
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
 # CLIENT
 import socket
-import struct
 import sys
 from faker import Faker
-import re
 import threading
+import time
 import traceback
+from queue import Queue, Empty
 import keyboard
 from pynput import keyboard
 
 import game
+import offer
+import rtt
 
 Bold = "\033[1m"
 Red = "\033[31;1m"
@@ -18,6 +20,10 @@ Yellow = "\033[33;1m"
 Blue = "\033[34;1m"
 end = "\033[0;1m"
 
+# Lines typed by the player, read by a background thread so that waiting for one can time out on every platform
+typed_lines = Queue()
+stdin_reader = None
+
 """
 Client Script for a Multiplayer Trivia Game
 
@@ -41,6 +47,41 @@ Author: Shir Mordechai Rozenfeld & Netta Meiri
 """
 
 
+def read_stdin():
+    """
+    Puts every line the player types in typed_lines, until the end of the input.
+    """
+    for line in sys.stdin:
+        typed_lines.put(line)
+
+
+def start_reading_stdin():
+    """
+    Starts the thread reading the lines typed by the player, unless it is already running.
+    """
+    global stdin_reader
+    if stdin_reader is None:
+        stdin_reader = threading.Thread(target=read_stdin, daemon=True)
+        stdin_reader.start()
+
+
+def read_line(timeout=None):
+    """
+        Reads a line typed by the player.
+
+        Parameters:
+        - timeout (float): The number of seconds to wait for the line, or None to wait as long as it takes.
+
+        Returns:
+        - The line without its end of line, or None if the player didn't finish typing it in time.
+    """
+    start_reading_stdin()
+    try:
+        return typed_lines.get(timeout=timeout).strip()
+    except Empty:
+        return None
+
+
 def receive_udp_offer(udp_socket):
     """
         Receive UDP offer messages from the server.
@@ -57,28 +98,33 @@ def receive_udp_offer(udp_socket):
     while True:
         try:
             data, server_address = udp_socket.recvfrom(1024)
-            magic_cookie = data[:4]
-            message_type = data[4]
-            if magic_cookie == b'\xab\xcd\xdc\xba' and message_type == 0x02:
-                server_name_end = data.find(b'\x00', 5)
-                server_name = data[5:server_name_end].decode('utf-8').strip()
-                # Extract server port bytes
-                server_tcp_port = data[37: 39]
-                # Unpack the bytes to get the server TCP port number
-                server_tcp_port_number = struct.unpack('!H', server_tcp_port)[0]
-                # Extract message
-                server_message_start = data.find(b'Received')
-                message = data[server_message_start:].decode('utf-8')
-                # Define a regular expression pattern to find the IP address after 'address'
-                pattern = r'address (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
-                # Find all matches of the pattern in the text
-                server_ip_address = re.search(pattern, message).group(1)
-                return magic_cookie, message_type, server_name, server_ip_address, server_tcp_port_number, message
+            server_offer = offer.parse_offer_packet(data)
+            if server_offer is not None:
+                return server_offer
         except Exception as e:
             print("receive_udp_offer:", e)
             break
 
 
+def receive_data(client_socket):
+    """
+        Receive data from the server, answering the ping frames it carries right away.
+
+        Parameters:
+        - client_socket (socket): The client's TCP socket for receiving messages.
+
+        Returns:
+        - The data without the ping frames, and False if the server closed the connection.
+    """
+    data = client_socket.recv(1024).decode()
+    if not data:
+        return "", False
+    data, pings = rtt.strip_pings(data)
+    for token in pings:
+        client_socket.sendall(rtt.pong_frame(token).encode())
+    return data, True
+
+
 def receive_tcp_messages(client_socket):
     """
        Receive messages from the server over a TCP connection.
@@ -87,20 +133,40 @@ def receive_tcp_messages(client_socket):
        - client_socket (socket): The client's TCP socket for receiving messages.
 
        Note:
-       - This function continuously receives messages.
+       - This function continuously receives messages, answering the server's pings (see `receive_data`).
        - If the received message contains specific keywords like "true or false" or "invalid input",
          it sends a message back to the server using the `send_tcp_messages` function.
+       - If the received message carries a batch of questions (game.BATCH_HEADER), it receives the whole batch
+         and answers all of it using the `send_batch_answers` function.
        - If the received message contains "game over" or "abandoned", it prints a message
          indicating that the server has disconnected.
        - If a `ConnectionResetError` occurs, it prints a message indicating the loss of connection.
    """
     try:
+        batch_size = 0
         while True:
             # Wait for incoming message
-            data = client_socket.recv(1024).decode()
-            if not data:
+            data, connected = receive_data(client_socket)
+            if not connected:
                 break
+            if not data:
+                # Only a ping
+                continue
+            if game.BATCH_HEADER in data:
+                # A batch may not fit in one segment, receive until its end
+                while game.BATCH_FOOTER not in data:
+                    more, connected = receive_data(client_socket)
+                    if not connected:
+                        break
+                    data += more
+                print(data)
+                batch_size = data.count("True or false:")
+                send_batch_answers(client_socket, batch_size)
+                continue
             print(data)
+            if "invalid batch" in data.lower():
+                send_batch_answers(client_socket, batch_size)
+                continue
             # Call send_tcp_messages so the client will enter input
             if "true or false" in data.lower() or "invalid input" in data.lower():
                 send_tcp_messages(client_socket)
@@ -145,13 +211,49 @@ def send_tcp_messages(client_socket):
                 return
             # Client entered input, send it to the server
             else:
-                input = sys.stdin.readline().strip()
+                input = read_line()
                 client_socket.sendall(input.encode())
 
     except ConnectionResetError as e:
         print(f'{Red}Connection with the server was lost, please wait for a new connection..')
 
 
+def send_batch_answers(client_socket, number_of_questions):
+    """
+        Send the answers to a batch of questions to the server, in one message.
+
+        Parameters:
+        - client_socket (socket): The client's TCP socket for sending messages.
+        - number_of_questions (int): The number of questions in the batch.
+
+        Note:
+        - The player types one answer per line. Each answer is sent with the time, in seconds since the batch
+          arrived, at which it was typed, and the server uses these times to decide who answered first.
+        - The player has 10 seconds per question for the whole batch. The deadline is enforced on the reading
+          of every line, so questions left unanswered when the time is up are sent as "e" (empty) right away.
+    """
+    try:
+        start = time.monotonic()
+        deadline = start + 10 * number_of_questions
+        lines = []
+        # Lines typed before the batch arrived, or after the time of a previous one was up, are not answers
+        while not typed_lines.empty():
+            typed_lines.get()
+        for i in range(number_of_questions):
+            remaining = deadline - time.monotonic()
+            # Wait for a whole line, but no longer than the time left
+            answer = read_line(remaining) if remaining > 0 else None
+            if answer is None:
+                print(f"{Red}Time's Up! You have exceeded the time window for answering")
+                lines += [f"e {time.monotonic() - start:.3f}"] * (number_of_questions - i)
+                break
+            lines.append(f"{answer or 'e'} {time.monotonic() - start:.3f}")
+        client_socket.sendall("\n".join(lines).encode())
+
+    except ConnectionResetError as e:
+        print(f'{Red}Connection with the server was lost, please wait for a new connection..')
+
+
 def main():
     """
         Main function to start the client-side application.
@@ -173,6 +275,7 @@ def main():
     fake = Faker()
     player_name = fake.name()
     game.print_welcome_message(player_name)
+    start_reading_stdin()
 
     server_udp_port = 13117
     try:
@@ -0,0 +1,166 @@
+import threading
+import time
+from queue import Queue
+
+"""
+Clocks and schedulers used by the trivia game server.
+
+The server waits on time in a few places: the 1-second cadence of the UDP offer
+broadcast, the 10-second lobby timeout, and the per-round fan-out of messages to
+the connected players. All of these go through a clock and a scheduler so the
+same game flow can run either on the wall clock with real threads (the default),
+or on virtual time with every task run inline (used by simulation.py).
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+
+class SystemClock:
+    """
+    Wall-clock time, backed by time.monotonic() and threading.Event.
+    """
+
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def event(self):
+        return threading.Event()
+
+    def wait(self, event, seconds):
+        """
+        Waits until the event is set or the given number of seconds has passed.
+        Returns: True if the event was set, False on timeout.
+        """
+        return event.wait(max(seconds, 0))
+
+
+class _VirtualEvent(threading.Event):
+    """
+    A threading.Event that wakes up threads waiting on a VirtualClock when set.
+    """
+
+    def __init__(self, clock):
+        super().__init__()
+        self._clock = clock
+
+    def set(self):
+        super().set()
+        with self._clock._condition:
+            self._clock._condition.notify_all()
+
+
+class VirtualClock:
+    """
+    Simulated time that only moves when it is told to.
+
+    sleep() and advance() move the clock forward immediately instead of blocking,
+    so a whole game can be played in a fraction of a second. Background threads
+    (such as the offer broadcaster) use wait(), which blocks until another thread
+    advances the clock past the deadline or the event is set.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._condition = threading.Condition()
+
+    def now(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.reset(self._now + max(seconds, 0))
+
+    def reset(self, timestamp):
+        """
+        Moves the clock to an absolute timestamp. Only InlineScheduler moves it backwards,
+        to start several "parallel" tasks from the same instant.
+        """
+        with self._condition:
+            self._now = timestamp
+            self._condition.notify_all()
+
+    def event(self):
+        return _VirtualEvent(self)
+
+    def wait(self, event, seconds):
+        with self._condition:
+            deadline = self._now + seconds
+            while not event.is_set() and self._now < deadline:
+                self._condition.wait()
+            return event.is_set()
+
+
+class ThreadScheduler:
+    """
+    Runs each task on its own thread and waits for all of them to finish.
+    """
+
+    def run(self, tasks):
+        threads = []
+        for target, args in tasks:
+            thread = threading.Thread(target=target, args=args)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+
+class _BufferedQueue:
+    """
+    Stands in for a queue.Queue passed to a task of an InlineScheduler, recording when every item was put.
+    Only put() is provided: anything else a task would do with the queue raises AttributeError.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.items = []
+
+    def put(self, item):
+        self.items.append((self.clock.now(), item))
+
+
+class InlineScheduler:
+    """
+    Runs tasks one after the other on the calling thread, on a VirtualClock.
+
+    Every task starts from the same virtual instant and the clock is left at the
+    time the slowest task finished, as if they had run in parallel. The items the
+    tasks put in the queues they were given are delivered in order of the virtual
+    time at which they were put, as the answers of concurrent clients would be.
+    If an rng is given the tasks run in a shuffled order, which breaks the ties.
+
+    The queues are put-only for the tasks: a queue.Queue argument is replaced by a
+    buffer while the task runs, and its items reach the real queue only once every
+    task has finished, so a task can never read from a queue (server.handle_client
+    only ever puts into its answers and dropouts queues).
+    """
+
+    def __init__(self, clock, rng=None):
+        self.clock = clock
+        self.rng = rng
+
+    def run(self, tasks):
+        tasks = list(tasks)
+        if self.rng is not None:
+            self.rng.shuffle(tasks)
+        start = self.clock.now()
+        finish = start
+        deliveries = []
+        for target, args in tasks:
+            self.clock.reset(start)
+            buffers = {}
+            target(*[buffers.setdefault(i, _BufferedQueue(self.clock)) if isinstance(arg, Queue) else arg
+                      for i, arg in enumerate(args)])
+            finish = max(finish, self.clock.now())
+            for i, buffer in buffers.items():
+                for put_at, item in buffer.items:
+                    deliveries.append((put_at, len(deliveries), args[i], item))
+        deliveries.sort(key=lambda delivery: (delivery[0], delivery[1]))
+        for put_at, order, queue, item in deliveries:
+            queue.put(item)
+        self.clock.reset(finish)
@@ -1,7 +1,8 @@
-import threading
 import random
+import threading
 from queue import Queue
 import server
+from clock import ThreadScheduler
 
 """
 This module contains functions related to running a trivia game server-side.
@@ -18,6 +19,39 @@ Yellow = "\033[33;1m"
 Blue = "\033[34;1m"
 end = "\033[0;1m"
 
+STATS_FILE = "stats.txt"
+# Games played by the matchmaking run concurrently, the statistics file is read and written by one at a time
+STATS_LOCK = threading.Lock()
+
+# Marks the beginning and the end of a message carrying a batch of questions
+BATCH_HEADER = "Batch round"
+BATCH_FOOTER = "Type one answer per line, Y/T/1 for 'True' or N/F/0 for 'False'."
+
+# List of trivia questions about Einstein
+TRIVIA_QUESTIONS = [
+    {"question": "Albert Einstein was born in Germany.", "is_true": True},
+    {"question": "Einstein was awarded the Nobel Prize in Chemistry.", "is_true": False},
+    {"question": "Albert Einstein was a proficient musician.", "is_true": True},
+    {"question": "Einstein failed mathematics in school.", "is_true": False},
+    {"question": "Albert Einstein developed the theory of relativity.", "is_true": True},
+    {"question": "Einstein published his Special Theory of Relativity in 1905.", "is_true": True},
+    {"question": "Albert Einstein's famous equation is E=mc^2.", "is_true": True},
+    {"question": "Einstein worked on the Manhattan Project.", "is_true": False},
+    {"question": "Albert Einstein had a patent for a refrigerator.", "is_true": True},
+    {"question": "Einstein was a citizen of three countries during his lifetime.", "is_true": True},
+    {"question": "Albert Einstein was a professor at Princeton University.", "is_true": True},
+    {"question": "Einstein was known for his advocacy of civil rights.", "is_true": True},
+    {"question": "Albert Einstein's brain was stolen after his death.", "is_true": True},
+    {"question": "Einstein received the US Presidential Medal of Freedom.", "is_true": True},
+    {"question": "Albert Einstein had a significant role in the development of quantum mechanics.",
+     "is_true": True},
+    {"question": "Einstein believed in a deterministic universe.", "is_true": False},
+    {"question": "Albert Einstein was offered the presidency of Israel.", "is_true": True},
+    {"question": "Einstein had a famous debate with Niels Bohr about quantum mechanics.", "is_true": True},
+    {"question": "Albert Einstein's last words were in German.", "is_true": False},
+    {"question": "Einstein was a vegetarian.", "is_true": True}
+]
+
 
 def print_welcome_message(player_name):
     with open("einstein.txt", "r") as file:
@@ -42,31 +76,8 @@ def pick_a_question():
 
     """
     try:
-        # List of trivia questions about sloths
-        trivia_questions = [
-            {"question": "Albert Einstein was born in Germany.", "is_true": True},
-            {"question": "Einstein was awarded the Nobel Prize in Chemistry.", "is_true": False},
-            {"question": "Albert Einstein was a proficient musician.", "is_true": True},
-            {"question": "Einstein failed mathematics in school.", "is_true": False},
-            {"question": "Albert Einstein developed the theory of relativity.", "is_true": True},
-            {"question": "Einstein published his Special Theory of Relativity in 1905.", "is_true": True},
-            {"question": "Albert Einstein's famous equation is E=mc^2.", "is_true": True},
-            {"question": "Einstein worked on the Manhattan Project.", "is_true": False},
-            {"question": "Albert Einstein had a patent for a refrigerator.", "is_true": True},
-            {"question": "Einstein was a citizen of three countries during his lifetime.", "is_true": True},
-            {"question": "Albert Einstein was a professor at Princeton University.", "is_true": True},
-            {"question": "Einstein was known for his advocacy of civil rights.", "is_true": True},
-            {"question": "Albert Einstein's brain was stolen after his death.", "is_true": True},
-            {"question": "Einstein received the US Presidential Medal of Freedom.", "is_true": True},
-            {"question": "Albert Einstein had a significant role in the development of quantum mechanics.",
-             "is_true": True},
-            {"question": "Einstein believed in a deterministic universe.", "is_true": False},
-            {"question": "Albert Einstein was offered the presidency of Israel.", "is_true": True},
-            {"question": "Einstein had a famous debate with Niels Bohr about quantum mechanics.", "is_true": True},
-            {"question": "Albert Einstein's last words were in German.", "is_true": False},
-            {"question": "Einstein was a vegetarian.", "is_true": True}
-        ]
-        # Shuffle the list of trivia questions
+        # Shuffle a copy of the list of trivia questions
+        trivia_questions = list(TRIVIA_QUESTIONS)
         random.shuffle(trivia_questions)
         return list(trivia_questions[0].values())[0], list(trivia_questions[0].values())[1]
 
@@ -74,7 +85,120 @@ def pick_a_question():
         print(f"{Red}Failed shuffeling a question from the bank")
 
 
-def trivia_game(client_sockets):
+def pick_questions(number_of_questions):
+    """
+    Randomly selects several different trivia questions from the predefined list.
+
+    Args:
+    - number_of_questions (int): The number of questions to pick, at most the size of the list.
+
+    Returns:
+    - questions (list): (question, is_true) tuples.
+
+    """
+    return [(trivia_question["question"], trivia_question["is_true"])
+            for trivia_question in random.sample(TRIVIA_QUESTIONS, number_of_questions)]
+
+
+def is_correct(answer, is_true):
+    """
+    Returns: True if the character typed by a player is the right answer to the question.
+    """
+    return (is_true == True and (answer == 'Y' or answer == 'T' or answer == "1")) or (
+            is_true == False and (answer == 'N' or answer == 'F' or answer == "0"))
+
+
+def send_to_clients(scheduler, client_sockets, message, should_wait_for_answer=False, answers=None, dropouts=None,
+                    rate_limiter=None, batch_size=1, rtt_tracker=None):
+    """
+        Sends a message to every connected client concurrently and waits until all of them are handled.
+
+        Args:
+        - scheduler: Runs the per-client handlers (see clock.py).
+        - client_sockets (dict): A dictionary containing client sockets.
+        - message (str): The message to send.
+        - should_wait_for_answer (bool): Whether to wait for an answer from each client.
+        - answers (queue.Queue): A queue collecting the answers, if waiting for them.
+        - dropouts (queue.Queue): A queue collecting the players that have disconnected.
+        - rate_limiter (rate_limit.RateLimiter): Limits the frames received from the clients.
+        - batch_size (int): The number of answers expected from each client.
+        - rtt_tracker (rtt.RttTracker): Records the round-trip times of the clients.
+
+    """
+    scheduler.run([(server.handle_client,
+                    (player_name, socket, message, should_wait_for_answer, answers, dropouts, rate_limiter, batch_size,
+                     rtt_tracker))
+                   for player_name, socket in client_sockets.items()])
+
+
+def welcome_message(client_sockets):
+    """
+        Returns: The message opening a game, listing the players.
+    """
+    message = f"{Yellow}Welcome to the SlothsWorld server, where we are answering trivia questions about Sloths."
+    i = 1
+    for player_name in client_sockets.keys():
+        message += f"\n {Yellow}Player {i}: {player_name}"
+        i += 1
+    return message
+
+
+def next_round_message(client_sockets, round, question, nobody_answered):
+    """
+        Returns: The message starting another round, after a round nobody won.
+    """
+    message = ""
+    if nobody_answered:
+        message += f"{Red}Nobody answered within 10 seconds. Another round begins."
+    else:
+        message += f"{Red}None of the players answered correctly, try again."
+    message += f"\n{Yellow}Round {round}, played by "
+    for player_name in client_sockets.keys():
+        message += f"{Yellow}{player_name}, "
+    message=message[:-1]
+    message += f"{Yellow}:\nTrue or false: " + question
+    return message
+
+
+def game_over_message(winner_name, stats_path, rate_limiter):
+    """
+        Returns: The message closing a game, with the statistics table.
+    """
+    message = f"{Yellow}Game over!\nContratulations to the winner: {winner_name}"
+    message += f"{Yellow}\n=======================================\n"
+    message += read_stats(stats_path)
+    message += rate_limiter.summary()
+    return message
+
+
+def receive_answers(answers, client_sockets, rtt_tracker, latency_compensation):
+    """
+        Empties the queue of answers of a round.
+
+        Args:
+        - answers (queue.Queue): (player name, answer, question sent time, arrival time) tuples, in arrival order.
+        - client_sockets (dict): A dictionary containing client sockets.
+        - rtt_tracker (rtt.RttTracker): The round-trip time estimates of the clients.
+        - latency_compensation (bool): Whether to order the answers by the time the players took to answer,
+          estimated as the time between sending the question and receiving the answer minus the smoothed
+          round-trip time of the client, instead of by arrival order.
+
+        Returns:
+        - round_answers (list): (player name, answer, question sent time, arrival time) tuples.
+
+    """
+    round_answers = []
+    while not answers.empty():
+        round_answers.append(answers.get())
+    if latency_compensation:
+        # The question travels down and the answer travels up, so the whole round trip is taken off
+        round_answers.sort(key=lambda player_answer: player_answer[3] - player_answer[2] -
+                           rtt_tracker.smoothed_rtt(client_sockets[player_answer[0]]))
+    return round_answers
+
+
+def trivia_game(client_sockets, scheduler=None, stats_path=STATS_FILE, rate_limiter=None, batch_size=1,
+                rtt_tracker=None, latency_compensation=False):
     """
         Manages the trivia game session with connected clients.
 
@@ -83,20 +207,32 @@ def trivia_game(client_sockets):
 
         Args:
         - client_sockets (dict): A dictionary containing client sockets.
+        - scheduler: Runs the per-client handlers of each round (see clock.py). Defaults to one thread per client.
+        - stats_path (str): The statistics file to update and summarize at the end of the game.
+        - rate_limiter (rate_limit.RateLimiter): Limits the frames received from the clients. Defaults to the server's.
+        - batch_size (int): The number of questions sent in each round. With more than one, the game is played
+          by batched_trivia_game.
+        - rtt_tracker (rtt.RttTracker): Records the round-trip times of the clients. Defaults to the server's.
+        - latency_compensation (bool): Whether the first correct answer is decided by estimated response time rather
+          than by arrival time (see receive_answers).
 
         Returns:
         - winner_name (str): The name of the winning player.
 
     """
+    if scheduler is None:
+        scheduler = ThreadScheduler()
+    if rate_limiter is None:
+        rate_limiter = server.RATE_LIMITER
+    if rtt_tracker is None:
+        rtt_tracker = server.RTT_TRACKER
+    if batch_size > 1:
+        return batched_trivia_game(client_sockets, batch_size, scheduler, stats_path, rate_limiter, rtt_tracker)
     try:
         question, is_true = pick_a_question()
         # create welcome message & question
-        message = f"{Yellow}Welcome to the SlothsWorld server, where we are answering trivia questions about Sloths."
-        i = 1
+        message = welcome_message(client_sockets)
         round = 1
-        for player_name in client_sockets.keys():
-            message += f"\n {Yellow}Player {i}: {player_name}"
-            i += 1
         message += f"{Yellow}\n==\nTrue or false: {question}"
         while True:
             no_answer = 0
@@ -104,19 +240,12 @@ def trivia_game(client_sockets):
             answers = Queue()
             dropouts = Queue()
             winner_flag = False
-            clients_threads = []
             # send message and wait for answers to the questions
             print(message)
             if len(client_sockets) == 0:
                 break
-            for player_name, socket in client_sockets.items():
-                thread = threading.Thread(target=server.handle_client, args=(player_name, socket, message, True, answers, dropouts))
-                thread.start()
-                clients_threads.append(thread)
-            for thread in clients_threads:
-                thread.join()
+            send_to_clients(scheduler, client_sockets, message, True, answers, dropouts, rate_limiter, 1, rtt_tracker)
             # input validation is done in handle_client function
-            clients_threads.clear()
             while not dropouts.empty():
                 quitting_player = dropouts.get()
                 del client_sockets[quitting_player]
@@ -124,43 +253,28 @@ def trivia_game(client_sockets):
             if len(client_sockets) == 1:
                 message = f"{Red}You have been abandoned by your friends, please try connecting to a new game with new friends"
                 print(message)
-                thread = threading.Thread(target=server.handle_client, args=(list(client_sockets.keys())[0], list(client_sockets.values())[0], message, False, None, None))
-                thread.start()
-                thread.join()
+                send_to_clients(scheduler, client_sockets, message)
                 return
             j = 0
-            while not answers.empty():
+            # fold out the player-answer tuples by FIFO order, or by estimated response time
+            for player_name, answer, sent_at, arrival in receive_answers(answers, client_sockets, rtt_tracker,
+                                                                latency_compensation):
                 j += 1
-                # fold out the player-answer tuples by FIFO order
-                player_name, answer = answers.get()
                 typed_characters.append(answer)
-                if (is_true == True and (answer == 'Y' or answer == 'T' or answer == "1")) or (
-                        is_true == False and (answer == 'N' or answer == 'F' or answer == "0")):
+                if is_correct(answer, is_true):
                     # There is a winner for this round!
                     winner_flag = True
                     winner_name = player_name
                     message = f"{Green}{winner_name} is correct! The answer is {is_true}. {winner_name} wins!"
                     # Send message 1
                     print(message)
-                    for player_name, socket in client_sockets.items():
-                        thread = threading.Thread(target=server.handle_client, args=(player_name, socket, message, False, None, None))
-                        thread.start()
-                        clients_threads.append(thread)
-                    for thread in clients_threads:
-                        thread.join()
-                    clients_threads.clear()
-                    add_to_stats(len(client_sockets), winner_flag, question, typed_characters)
-                    message = f"{Yellow}Game over!\nContratulations to the winner: {winner_name}"
-                    message += f"{Yellow}\n=======================================\n"
-                    message += read_stats()
+                    print(rtt_tracker.summary(client_sockets))
+                    send_to_clients(scheduler, client_sockets, message)
+                    add_to_stats(len(client_sockets), winner_flag, question, typed_characters, stats_path)
+                    message = game_over_message(winner_name, stats_path, rate_limiter)
                     print(message)
                     # Send message 2
-                    for player_name, socket in client_sockets.items():
-                        thread = threading.Thread(target=server.handle_client, args=(player_name, socket, message, False, None, None))
-                        thread.start()
-                        clients_threads.append(thread)
-                    for thread in clients_threads:
-                        thread.join()
+                    send_to_clients(scheduler, client_sockets, message)
                     break
                 # means client didn't answer within 10 seconds
                 if answer == "e":
@@ -171,18 +285,9 @@ def trivia_game(client_sockets):
                         break
             # If nobody answers correctly, or answered at all, another round begins
             if not winner_flag and len(client_sockets) != 0:
-                message = ""
-                if j == 0: #nobody answered at all
-                    message += f"{Red}Nobody answered within 10 seconds. Another round begins."
-                else:
-                    message += f"{Red}None of the players answered correctly, try again."
                 round += 1
                 question, is_true = pick_a_question()
-                message += f"\n{Yellow}Round {round}, played by "
-                for player_name in client_sockets.keys():
-                    message += f"{Yellow}{player_name}, "
-                message=message[:-1]
-                message += f"{Yellow}:\nTrue or false: " + question
+                message = next_round_message(client_sockets, round, question, j == 0)
             # there is a winner, end game
             else:
                 for client_socket in client_sockets.values():
@@ -192,7 +297,137 @@ def trivia_game(client_sockets):
         print(f"{Red}Failed running the trivia game: {e}")
 
 
-def add_to_stats(number_of_players, winner_flag, question, typed_characters):
+def batch_message(questions, round):
+    """
+        Returns: The message carrying a batch of questions, between BATCH_HEADER and BATCH_FOOTER.
+    """
+    message = f"{Yellow}{BATCH_HEADER} {round}: answer all {len(questions)} questions, in order."
+    for i, (question, is_true) in enumerate(questions, 1):
+        message += f"\n{Yellow}{i}. True or false: {question}"
+    message += f"\n{Yellow}{BATCH_FOOTER}"
+    return message
+
+
+def score_batch(questions, batch_answers):
+    """
+        Scores a batch of questions. Each question is won by the player whose correct answer has the
+        earliest timestamp, measured by the client from the moment it received the batch.
+
+        Args:
+        - questions (list): (question, is_true) tuples.
+        - batch_answers (list): (player_name, [(answer, timestamp), ...]) tuples, with one answer per question.
+
+        Returns:
+        - points (dict): The number of questions each player won.
+        - question_winners (list): The winner of each question, or None if nobody answered it correctly.
+        - typed_characters (list): The characters typed by the players for each question.
+
+    """
+    points = {player_name: 0 for player_name, player_answers in batch_answers}
+    question_winners = []
+    typed_characters = []
+    for q, (question, is_true) in enumerate(questions):
+        question_winner = None
+        first_timestamp = None
+        typed = []
+        for player_name, player_answers in batch_answers:
+            answer, timestamp = player_answers[q]
+            typed.append(answer)
+            if is_correct(answer, is_true) and (first_timestamp is None or timestamp < first_timestamp):
+                question_winner = player_name
+                first_timestamp = timestamp
+        if question_winner is not None:
+            points[question_winner] += 1
+        question_winners.append(question_winner)
+        typed_characters.append(typed)
+    return points, question_winners, typed_characters
+
+
+def batched_trivia_game(client_sockets, batch_size, scheduler, stats_path, rate_limiter, rtt_tracker):
+    """
+        Manages a trivia game session in which every round is a batch of questions.
+
+        The questions of a round are sent to the clients in one message and each client returns all of its
+        answers, with timestamps, in one message, which saves a round trip per question on slow links.
+        The player who won the most questions of a batch wins the game; on a tie another batch is played.
+
+        Args:
+        - client_sockets (dict): A dictionary containing client sockets.
+        - batch_size (int): The number of questions in each batch, at most the size of the question list.
+        - scheduler: Runs the per-client handlers of each round (see clock.py).
+        - stats_path (str): The statistics file to update and summarize at the end of the game.
+        - rate_limiter (rate_limit.RateLimiter): Limits the frames received from the clients.
+        - rtt_tracker (rtt.RttTracker): Records the round-trip times of the clients.
+
+        Returns:
+        - winner_name (str): The name of the winning player.
+
+    """
+    try:
+        batch_size = min(batch_size, len(TRIVIA_QUESTIONS))
+        round = 1
+        questions = pick_questions(batch_size)
+        message = welcome_message(client_sockets)
+        message += f"{Yellow}\n==\n" + batch_message(questions, round)
+        while True:
+            answers = Queue()
+            dropouts = Queue()
+            print(message)
+            if len(client_sockets) == 0:
+                break
+            send_to_clients(scheduler, client_sockets, message, True, answers, dropouts, rate_limiter, batch_size,
+                            rtt_tracker)
+            # input validation is done in handle_client function
+            while not dropouts.empty():
+                quitting_player = dropouts.get()
+                del client_sockets[quitting_player]
+
+            if len(client_sockets) == 1:
+                message = f"{Red}You have been abandoned by your friends, please try connecting to a new game with new friends"
+                print(message)
+                send_to_clients(scheduler, client_sockets, message)
+                return
+            # the answers carry their own timestamps, so there is nothing to compensate for
+            batch_answers = [(player_name, player_answers) for player_name, player_answers, sent_at, arrival
+                             in receive_answers(answers, client_sockets, rtt_tracker, False)]
+            points, question_winners, typed_characters = score_batch(questions, batch_answers)
+            message = f"{Yellow}Results of round {round}:"
+            for i in range(len(questions)):
+                question, is_true = questions[i]
+                add_to_stats(len(client_sockets), question_winners[i] is not None, question, typed_characters[i],
+                             stats_path)
+                if question_winners[i] is None:
+                    message += f"\n{Yellow}{i + 1}. The answer is {is_true}, nobody answered correctly."
+                else:
+                    message += f"\n{Yellow}{i + 1}. The answer is {is_true}, {question_winners[i]} was the first to answer correctly."
+            best_score = max(points.values(), default=0)
+            leaders = [player_name for player_name, score in points.items() if score == best_score]
+            if best_score > 0 and len(leaders) == 1:
+                # There is a winner for this game!
+                winner_name = leaders[0]
+                message += f"\n{Green}{winner_name} won {best_score} of {len(questions)} questions. {winner_name} wins!"
+                print(message)
+                print(rtt_tracker.summary(client_sockets))
+                send_to_clients(scheduler, client_sockets, message)
+                message = game_over_message(winner_name, stats_path, rate_limiter)
+                print(message)
+                send_to_clients(scheduler, client_sockets, message)
+                for client_socket in client_sockets.values():
+                    client_socket.close()
+                return winner_name
+            # If nobody answers correctly, or the best players are tied, another batch begins
+            if best_score == 0:
+                message += f"\n{Red}None of the players answered correctly, try again."
+            else:
+                message += f"\n{Red}It's a tie between {', '.join(leaders)}, another round begins."
+            round += 1
+            questions = pick_questions(batch_size)
+            message += "\n" + batch_message(questions, round)
+    except Exception as e:
+        print(f"{Red}Failed running the trivia game: {e}")
+
+
+def add_to_stats(number_of_players, winner_flag, question, typed_characters, stats_path=STATS_FILE):
     """
         Records game statistics in a text file.
 
@@ -201,9 +436,10 @@ def add_to_stats(number_of_players, winner_flag, question, typed_characters):
         - winner_flag (bool): A flag indicating whether there is a winner.
         - question (str): The trivia question.
         - typed_characters (list): A list of characters typed by players as answers.
+        - stats_path (str): The statistics file to append to.
 
     """
-    with open("stats.txt", "a") as file:
+    with STATS_LOCK, open(stats_path, "a") as file:
         file.write(f"question that was asked:{question}" + '\n')
         if not winner_flag:
             file.write(f"a question nobody managed to answer:{question}" + '\n')
@@ -212,10 +448,13 @@ def add_to_stats(number_of_players, winner_flag, question, typed_characters):
             file.write(f"{chracter}" + '\n')
 
 
-def read_stats():
+def read_stats(stats_path=STATS_FILE):
     """
         Reads game statistics from a text file and generates a summary.
 
+        Args:
+        - stats_path (str): The statistics file to read.
+
         Returns:
         - message (str): A summary of game statistics.
 
@@ -226,7 +465,7 @@ def read_stats():
         number_of_players = {}
         typed_answers={'F': 0, 'N': 0, '0': 0, 'T': 0, 'Y': 0, '1': 0}
         message = ""
-        with open("stats.txt", "r") as file:
+        with STATS_LOCK, open(stats_path, "r") as file:
             for line in file:
                 line = line.rstrip()
                 double_points = line.find(":")
@@ -284,6 +523,6 @@ def read_stats():
         return message
 
     except FileNotFoundError:
-        print(f"{Red}The file 'stats.txt' does not exist.")
+        print(f"{Red}The file '{stats_path}' does not exist.")
     except Exception as e:
         print(f"{Red}Failed reading statistics: {e}")
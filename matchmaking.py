@@ -0,0 +1,182 @@
+import threading
+from collections import deque
+
+from clock import SystemClock
+
+"""
+Skill-based matchmaking for the trivia game server.
+
+Players who joined a lobby wait in a MatchmakingQueue until they are matched with players
+of a similar skill. The skill of a player is their smoothed win rate, read from the
+history of the games they played (players.txt). Waiting players are kept in a fixed number
+of skill buckets, each a FIFO queue, so forming a game only looks at the front of a few
+buckets no matter how many players are waiting. The longer a player waits, the wider the
+range of skills they can be matched with, up to MAX_WAIT seconds after which anybody will do.
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+HISTORY_FILE = "players.txt"
+NUMBER_OF_BUCKETS = 20  # skill buckets over [0, 1]
+MIN_PLAYERS = 2
+MAX_PLAYERS = 6  # players in a game formed by the matchmaking
+BASE_WINDOW = 0.1  # skill distance allowed to a player that just joined
+WIDENING_RATE = 0.02  # skill distance added for every second of waiting
+MAX_WAIT = 45  # seconds after which a player is matched with any skill, or sent home if alone
+
+
+class PlayerHistory:
+    """
+    Games played and won by every player name, kept in memory and appended to a text file.
+    """
+
+    def __init__(self, history_path=HISTORY_FILE):
+        self.history_path = history_path
+        self.played = {}
+        self.won = {}
+        self.lock = threading.Lock()
+        try:
+            with open(history_path, "r") as file:
+                for line in file:
+                    line = line.rstrip()
+                    double_points = line.find(":")
+                    if line.startswith("played:"):
+                        player_name = line[double_points + 1:]
+                        self.played[player_name] = self.played.get(player_name, 0) + 1
+                    elif line.startswith("won:"):
+                        player_name = line[double_points + 1:]
+                        self.won[player_name] = self.won.get(player_name, 0) + 1
+        except FileNotFoundError:
+            # No game was played yet
+            pass
+
+    def skill(self, player_name):
+        """
+        Returns: The win rate of the player, smoothed so that a new player starts at 0.5.
+        """
+        return (self.won.get(player_name, 0) + 1) / (self.played.get(player_name, 0) + 2)
+
+    def record_game(self, player_names, winner_name):
+        """
+        Records a game in memory and in the history file.
+
+        Parameters:
+        - player_names (list): The names of the players of the game.
+        - winner_name (str): The name of the winner, or None if there was none.
+        """
+        with self.lock:
+            with open(self.history_path, "a") as file:
+                for player_name in player_names:
+                    self.played[player_name] = self.played.get(player_name, 0) + 1
+                    file.write(f"played:{player_name}" + '\n')
+                if winner_name is not None:
+                    self.won[winner_name] = self.won.get(winner_name, 0) + 1
+                    file.write(f"won:{winner_name}" + '\n')
+
+
+def unique_names(players):
+    """
+    Makes the names of the players of a game unique, so that they can tell each other apart.
+
+    Parameters:
+    - players (list): (player_name, client_socket) tuples, in which several players may share a name.
+
+    Returns:
+    - client_sockets (dict): The client sockets keyed by the names the players are shown under - "Name #2" for
+      the second player called "Name".
+    - player_names (dict): The names the history knows the players by, keyed by the names they are shown under.
+    """
+    client_sockets = {}
+    player_names = {}
+    for player_name, client_socket in players:
+        display_name = player_name
+        i = 2
+        while display_name in client_sockets:
+            display_name = f"{player_name} #{i}"
+            i += 1
+        client_sockets[display_name] = client_socket
+        player_names[display_name] = player_name
+    return client_sockets, player_names
+
+
+class _WaitingPlayer:
+    __slots__ = ("player_name", "client_socket", "skill", "joined_at")
+
+    def __init__(self, player_name, client_socket, skill, joined_at):
+        self.player_name = player_name
+        self.client_socket = client_socket
+        self.skill = skill
+        self.joined_at = joined_at
+
+
+class MatchmakingQueue:
+    """
+    Players waiting to be matched, bucketed by skill.
+    """
+
+    def __init__(self, history, clock=None):
+        self.history = history
+        self.clock = clock if clock is not None else SystemClock()
+        self.buckets = [deque() for i in range(NUMBER_OF_BUCKETS)]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def bucket_of(self, skill):
+        return min(int(skill * NUMBER_OF_BUCKETS), NUMBER_OF_BUCKETS - 1)
+
+    def add(self, player_name, client_socket):
+        skill = self.history.skill(player_name)
+        self.buckets[self.bucket_of(skill)].append(
+            _WaitingPlayer(player_name, client_socket, skill, self.clock.now()))
+        self.size += 1
+
+    def candidates(self, anchor_bucket, window):
+        """
+        Returns: Up to MAX_PLAYERS waiting players within the skill window around the front player of a bucket,
+        nearest buckets first and oldest first within a bucket.
+        """
+        anchor = self.buckets[anchor_bucket][0]
+        reach = int(window * NUMBER_OF_BUCKETS) + 1
+        candidates = []
+        for distance in range(reach + 1):
+            for bucket in (anchor_bucket - distance, anchor_bucket + distance) if distance else (anchor_bucket,):
+                if bucket < 0 or bucket >= NUMBER_OF_BUCKETS:
+                    continue
+                for waiting_player in self.buckets[bucket]:
+                    if len(candidates) == MAX_PLAYERS:
+                        return candidates
+                    if abs(waiting_player.skill - anchor.skill) <= window:
+                        candidates.append(waiting_player)
+                    else:
+                        break
+        return candidates
+
+    def poll(self):
+        """
+        Forms games out of the waiting players. The oldest player of every bucket is matched with the nearest
+        players in skill, within a window that widens with its waiting time.
+
+        Returns:
+        - lobbies (list): (client_sockets, player_names) tuples, one per game. client_sockets is a dictionary of
+          client sockets keyed by the names the players are shown under, which are made unique within the game,
+          and player_names maps these names back to the names the history knows the players by (see unique_names).
+          A game with a single player means the player waited MAX_WAIT seconds without finding anybody to play with.
+        """
+        now = self.clock.now()
+        lobbies = []
+        for anchor_bucket in range(NUMBER_OF_BUCKETS):
+            while self.buckets[anchor_bucket]:
+                waited = now - self.buckets[anchor_bucket][0].joined_at
+                window = 1 if waited >= MAX_WAIT else BASE_WINDOW + WIDENING_RATE * waited
+                candidates = self.candidates(anchor_bucket, window)
+                if len(candidates) < MIN_PLAYERS and waited < MAX_WAIT:
+                    break
+                for waiting_player in candidates:
+                    self.buckets[self.bucket_of(waiting_player.skill)].remove(waiting_player)
+                    self.size -= 1
+                # Players may share a name
+                lobbies.append(unique_names([(waiting_player.player_name, waiting_player.client_socket)
+                                             for waiting_player in candidates]))
+        return lobbies
@@ -0,0 +1,68 @@
+import re
+import struct
+
+"""
+The offer packet the server broadcasts over UDP to announce a game, and its parsing by the client.
+
+Packet format:
+- Magic cookie (4 bytes): 0xabcddcba.
+- Message type (1 byte): 0x2 for an offer.
+- Server name (32 bytes): UTF-8, padded with null bytes.
+- Server port (2 bytes): The TCP port the server listens on, in network byte order.
+- A human-readable message announcing the offer, which carries the server's IP address.
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+MAGIC_COOKIE = b'\xab\xcd\xdc\xba'
+OFFER_MESSAGE_TYPE = 0x02
+
+
+def build_offer_packet(server_name, server_ip_address, server_tcp_port_number):
+    """
+    Builds an offer packet.
+    Parameters:
+    - server_name (str): The name of the server, at most 32 bytes.
+    - server_ip_address (str): The IP address of the server in the LAN.
+    - server_tcp_port_number (int): The TCP port number of the server.
+    Returns: The packet (bytes).
+    """
+    # Construct message
+    message = f"Received offer from server \"{server_name}\" at address {server_ip_address}, attempting to connect..."
+    # Packet format
+    message_type = bytes([OFFER_MESSAGE_TYPE])
+    server_name_bytes = server_name.encode().ljust(32, b'\x00')
+    server_port_bytes = struct.pack("!H", server_tcp_port_number)
+    # Concatenate packet components
+    return MAGIC_COOKIE + message_type + server_name_bytes + server_port_bytes + message.encode()
+
+
+def parse_offer_packet(data):
+    """
+    Parses an offer packet.
+
+    Parameters:
+    - data (bytes): A packet received on the broadcast port.
+
+    Returns:
+    - The server's offer details - magic cookie, message type, server name, server IP address, server TCP port
+      number and message - or None if the packet is not an offer.
+    """
+    magic_cookie = data[:4]
+    message_type = data[4]
+    if magic_cookie != MAGIC_COOKIE or message_type != OFFER_MESSAGE_TYPE:
+        return None
+    server_name_end = data.find(b'\x00', 5)
+    server_name = data[5:server_name_end].decode('utf-8').strip()
+    # Extract server port bytes
+    server_tcp_port = data[37: 39]
+    # Unpack the bytes to get the server TCP port number
+    server_tcp_port_number = struct.unpack('!H', server_tcp_port)[0]
+    # Extract message
+    server_message_start = data.find(b'Received')
+    message = data[server_message_start:].decode('utf-8')
+    # Define a regular expression pattern to find the IP address after 'address'
+    pattern = r'address (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
+    # Find all matches of the pattern in the text
+    server_ip_address = re.search(pattern, message).group(1)
+    return magic_cookie, message_type, server_name, server_ip_address, server_tcp_port_number, message
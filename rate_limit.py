@@ -0,0 +1,158 @@
+import threading
+import weakref
+
+from clock import SystemClock
+
+"""
+Rate limiting of inbound frames for the trivia game server.
+
+Every frame a client sends costs the server a decode, a validation and possibly an
+error message, so a client flooding the server with invalid answers can pin a thread
+and the network. Each connection gets a token bucket, and all connections share a
+global one. When the global bucket is empty, frames wait for a token instead of being
+dropped, so a well-behaved client's answer is not lost because of somebody else's
+flood - unless the wait would exceed MAX_GLOBAL_WAIT, which bounds how long the whole
+server can fall behind. A connection that runs out of its own tokens is penalized in escalating steps:
+1. Its frames are dropped silently.
+2. After MUTE_AFTER violations it is muted for MUTE_SECONDS - every frame is dropped.
+3. After DISCONNECT_AFTER violations it is disconnected.
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+CONNECTION_RATE = 5  # frames per second a single connection may send
+CONNECTION_BURST = 10
+GLOBAL_RATE = 1000  # frames per second all connections together may send
+GLOBAL_BURST = 2000
+MAX_GLOBAL_WAIT = 0.5  # seconds a frame may wait for a global token before it is dropped
+MUTE_AFTER = 10  # violations before a connection is muted
+MUTE_SECONDS = 5
+DISCONNECT_AFTER = 30  # violations before a connection is disconnected
+
+ALLOW = "allow"
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+
+class TokenBucket:
+    """
+    A token bucket refilled lazily on every call, so an idle bucket costs nothing.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, now):
+        """
+        Takes one token if there is one.
+        Returns: True if the frame is within the rate, False otherwise.
+        """
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now, max_wait):
+        """
+        Takes one token, going into debt if there is none, as long as the debt can be repaid within max_wait seconds.
+        Returns: The number of seconds to wait until the token is actually available, 0 if it already is,
+        or None if the wait would be longer than max_wait, in which case no token is taken.
+        """
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        wait = max(0, (1 - self.tokens) / self.rate) if self.tokens < 1 else 0
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+
+class _ConnectionState:
+    __slots__ = ("bucket", "violations", "muted_until")
+
+    def __init__(self, now):
+        self.bucket = TokenBucket(CONNECTION_RATE, CONNECTION_BURST, now)
+        self.violations = 0
+        self.muted_until = None
+
+
+class RateLimiter:
+    """
+    Per-connection and global rate limiting of inbound frames.
+
+    Connections are tracked in a WeakKeyDictionary keyed by their socket, so the state of a
+    connection goes away with its socket and nothing has to be cleaned up explicitly.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST, self.clock.now())
+        self.connections = weakref.WeakKeyDictionary()
+        self.counts = {"dropped": 0, "delayed_global": 0, "dropped_global": 0, "muted": 0, "disconnected": 0}
+        self.lock = threading.Lock()
+
+    def check(self, client_socket):
+        """
+        Accounts for one inbound frame from a client.
+
+        Parameters:
+        - client_socket (socket.socket): The connection the frame arrived on.
+
+        Returns: ALLOW if the frame should be handled, DROP if it should be ignored,
+        or DISCONNECT if the connection should be closed. When the global bucket is empty,
+        blocks until a global token is available and then returns ALLOW, or returns DROP if
+        that would take longer than MAX_GLOBAL_WAIT.
+        """
+        with self.lock:
+            now = self.clock.now()
+            state = self.connections.get(client_socket)
+            if state is None:
+                state = _ConnectionState(now)
+                self.connections[client_socket] = state
+            muted = state.muted_until is not None and now < state.muted_until
+            if not muted and state.bucket.consume(now):
+                # The whole server may be overloaded, but this connection is not to blame: wait, don't drop
+                wait = self.global_bucket.reserve(now, MAX_GLOBAL_WAIT)
+                if wait is None:
+                    # Overloaded for longer than a frame may wait, this connection is still not penalized
+                    self.counts["dropped_global"] += 1
+                    return DROP
+                if wait > 0:
+                    self.counts["delayed_global"] += 1
+            else:
+                wait = None
+                state.violations += 1
+        if wait is not None:
+            if wait > 0:
+                self.clock.sleep(wait)
+            return ALLOW
+        with self.lock:
+            if state.violations >= DISCONNECT_AFTER:
+                self.counts["disconnected"] += 1
+                del self.connections[client_socket]
+                return DISCONNECT
+            if state.violations == MUTE_AFTER:
+                state.muted_until = now + MUTE_SECONDS
+                self.counts["muted"] += 1
+            self.counts["dropped"] += 1
+            return DROP
+
+    def summary(self):
+        """
+        Returns: A summary of the rate limiting so far, in the format of the statistics table.
+        """
+        with self.lock:
+            counts = dict(self.counts)
+        return (f"\n\tRate limiting: {counts['dropped']} frames dropped, "
+                f"{counts['delayed_global']} frames delayed and {counts['dropped_global']} dropped by the global limit, "
+                f"{counts['muted']} players muted, {counts['disconnected']} players disconnected")
@@ -0,0 +1,165 @@
+import re
+import threading
+import weakref
+from collections import deque
+
+from clock import SystemClock
+
+"""
+Round-trip time estimation for the trivia game server.
+
+The server measures the latency of every connection with timestamped ping/pong frames:
+it sends "<PING t>", with t read from its own clock, and the client echoes "<PONG t>"
+as soon as it sees it. Pings are exchanged with all the players of a lobby when it
+closes, and a ping is piggybacked on every question during the game.
+
+Each connection keeps a smoothed RTT and an RTT variation (jitter), updated like TCP's
+retransmission timer (RFC 6298), and its last RTT_HISTORY samples for percentiles.
+Only echoes of pings the server actually sent to the connection are taken as samples,
+each at most once, and a sample is capped at MAX_SAMPLE seconds, so a client cannot
+make its link look faster or slower than it is by forging pongs.
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+ALPHA = 1 / 8  # weight of a new sample in the smoothed RTT
+BETA = 1 / 4  # weight of a new sample in the RTT variation
+RTT_HISTORY = 64  # samples kept per connection for the distribution
+OUTSTANDING_PINGS = 8  # pings per connection whose pong is still accepted
+MAX_SAMPLE = 1  # seconds an RTT sample is capped at, the server's ping timeout
+
+PING_PATTERN = re.compile(r"<PING (\d+(?:\.\d+)?)>")
+PONG_PATTERN = re.compile(r"<PONG (\d+(?:\.\d+)?)>")
+
+
+def ping_frame(timestamp):
+    return f"<PING {timestamp:.6f}>"
+
+
+def pong_frame(token):
+    return f"<PONG {token}>"
+
+
+def strip_pings(data):
+    """
+    Separates the ping frames from the rest of the data received by a client.
+    Returns: The data without the pings, and the list of ping tokens to echo back.
+    """
+    return PING_PATTERN.sub("", data), PING_PATTERN.findall(data)
+
+
+def strip_pongs(data):
+    """
+    Separates the pong frames from the rest of the data received by the server.
+    Returns: The data without the pongs, and the list of timestamps the pongs echo.
+    """
+    return PONG_PATTERN.sub("", data), [float(token) for token in PONG_PATTERN.findall(data)]
+
+
+class _ConnectionRtt:
+    __slots__ = ("player_name", "srtt", "rttvar", "samples", "outstanding")
+
+    def __init__(self, player_name):
+        self.player_name = player_name
+        self.srtt = None
+        self.rttvar = None
+        self.samples = deque(maxlen=RTT_HISTORY)
+        # The timestamps of the pings sent and not echoed yet
+        self.outstanding = deque(maxlen=OUTSTANDING_PINGS)
+
+
+class RttTracker:
+    """
+    Per-connection RTT estimates, kept in a WeakKeyDictionary keyed by the socket like rate_limit.RateLimiter.
+    """
+
+    def __init__(self, clock=None, max_sample=MAX_SAMPLE):
+        self.clock = clock if clock is not None else SystemClock()
+        self.max_sample = max_sample
+        self.connections = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def _state(self, client_socket, player_name):
+        state = self.connections.get(client_socket)
+        if state is None:
+            state = _ConnectionRtt(player_name)
+            self.connections[client_socket] = state
+        state.player_name = player_name
+        return state
+
+    def ping(self, client_socket, player_name):
+        """
+        Returns: A ping frame to send to a connection. Its timestamp is remembered, so that its pong is accepted.
+        """
+        # The timestamp as the pong will echo it
+        sent_at = float(f"{self.clock.now():.6f}")
+        with self.lock:
+            self._state(client_socket, player_name).outstanding.append(sent_at)
+        return ping_frame(sent_at)
+
+    def record(self, client_socket, player_name, sent_at):
+        """
+        Records an RTT sample for a connection, from the timestamp echoed by a pong. Echoes of timestamps that
+        were not sent to the connection by ping(), or that were already echoed, are ignored.
+        """
+        with self.lock:
+            state = self._state(client_socket, player_name)
+            if sent_at not in state.outstanding:
+                return
+            state.outstanding.remove(sent_at)
+            sample = min(self.clock.now() - sent_at, self.max_sample)
+            if sample < 0:
+                return
+            if state.srtt is None:
+                state.srtt = sample
+                state.rttvar = sample / 2
+            else:
+                state.rttvar = (1 - BETA) * state.rttvar + BETA * abs(state.srtt - sample)
+                state.srtt = (1 - ALPHA) * state.srtt + ALPHA * sample
+            state.samples.append(sample)
+
+    def smoothed_rtt(self, client_socket):
+        """
+        Returns: The smoothed RTT of a connection, or 0 if the connection was never measured.
+        """
+        state = self.connections.get(client_socket)
+        if state is None or state.srtt is None:
+            return 0
+        return state.srtt
+
+    def distribution(self, client_socket):
+        """
+        Returns: A dictionary with the smoothed RTT, the jitter and percentiles of the recent samples of a connection,
+        in seconds, or None if the connection was never measured.
+        """
+        with self.lock:
+            state = self.connections.get(client_socket)
+            if state is None or not state.samples:
+                return None
+            samples = sorted(state.samples)
+            return {
+                "player_name": state.player_name,
+                "samples": len(samples),
+                "srtt": state.srtt,
+                "jitter": state.rttvar,
+                "min": samples[0],
+                "median": samples[len(samples) // 2],
+                "p90": samples[min(len(samples) - 1, int(len(samples) * 0.9))],
+                "max": samples[-1],
+            }
+
+    def summary(self, client_sockets):
+        """
+        Returns: A table of the RTT of the given players, in milliseconds, for the server's log.
+        """
+        message = "Round-trip times (ms):"
+        for player_name, client_socket in client_sockets.items():
+            distribution = self.distribution(client_socket)
+            if distribution is None:
+                message += f"\n\t{player_name}: not measured"
+                continue
+            message += (f"\n\t{player_name}: srtt {distribution['srtt'] * 1000:.1f}, "
+                        f"jitter {distribution['jitter'] * 1000:.1f}, "
+                        f"median {distribution['median'] * 1000:.1f}, p90 {distribution['p90'] * 1000:.1f}, "
+                        f"max {distribution['max'] * 1000:.1f} over {distribution['samples']} samples")
+        return message
@@ -1,11 +1,12 @@
-import struct
-import time
+import math
 import threading
-import random
-from queue import Queue
-from faker import Faker
 import socket
 import game
+from clock import SystemClock, ThreadScheduler
+import rate_limit
+import rtt
+import offer
+import matchmaking
 
 Bold = "\033[1m"
 Red = "\033[31;1m"
@@ -14,6 +15,21 @@ Yellow = "\033[33;1m"
 Blue = "\033[34;1m"
 end = "\033[0;1m"
 
+OFFER_INTERVAL = 1  # seconds between two UDP offer messages
+LOBBY_TIMEOUT = 10  # seconds to wait for the next player before the game starts
+ANSWER_TIMEOUT = 10  # seconds a player has to answer a question (enforced by the client)
+BATCH_SIZE = 1  # questions sent in each round trip, 1 plays the classic one-question rounds
+VALID_ANSWERS = ["Y", "T", "1", "N", "F", "0", "e"]
+PING_COUNT = 3  # pings exchanged with every player when the lobby closes
+PING_TIMEOUT = 1  # seconds to wait for a pong in the lobby
+MAX_LOBBY_WHILE_WAITING = 10  # seconds a lobby stays open, however many players join, while others wait to be matched
+LATENCY_COMPENSATION = False  # order the answers by estimated response time instead of arrival time
+
+# Limits the inbound frames of all the connections of this server
+RATE_LIMITER = rate_limit.RateLimiter()
+# Estimates the round-trip time of all the connections of this server
+RTT_TRACKER = rtt.RttTracker(max_sample=PING_TIMEOUT)
+
 """
 Server Script for a Multiplayer Trivia Game
 
@@ -81,7 +97,8 @@ def get_free_port():
 
 
 
-def send_udp_broadcast_message(server_ip_address, server_broadcast_port, server_tcp_port_number, stop_event):
+def send_udp_broadcast_message(server_ip_address, server_broadcast_port, server_tcp_port_number, stop_event,
+                               clock=None, socket_factory=socket.socket):
     """
     Sending UDP packets on broadcast, offering end-users in the LAN to connect the server and join the game.
     Parameters:
@@ -89,12 +106,16 @@ def send_udp_broadcast_message(server_ip_address, server_broadcast_port, server_
     - server_broadcast_port (int): The port number on which the broadcast message will be sent.
     - server_tcp_port_number (int): The TCP port number of the server.
     - stop_event (threading.Event): A threading event object used to control the execution of the function.
+    - clock: The clock used to pace the offers (see clock.py). Defaults to the wall clock.
+    - socket_factory: Callable used to create the UDP socket. Defaults to socket.socket.
     Returns: None
     """
+    if clock is None:
+        clock = SystemClock()
     broadcast_ip = "255.255.255.255"
     server_name = "TONGUE"
     # set UDP socket properties
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket = socket_factory(socket.AF_INET, socket.SOCK_DGRAM)
     # set socket options to allow broadcast
     udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -102,95 +123,179 @@ def send_udp_broadcast_message(server_ip_address, server_broadcast_port, server_
     # send broadcast message
     try:
         print(f"{Yellow}Server started, listening on IP address {server_ip_address}")
+        next_offer = clock.now()
         while not stop_event.is_set():
-            # Construct message
-            message = f"Received offer from server \"{server_name}\" at address {server_ip_address}, attempting to connect..."
-            # Packet format
-            magic_cookie = b'\xab\xcd\xdc\xba'
-            message_type = b'\x02'
-            server_name_bytes = server_name.encode().ljust(32, b'\x00')
-            server_port_bytes = struct.pack("!H", server_tcp_port_number)
-            # Concatenate packet components
-            packet = magic_cookie + message_type + server_name_bytes + server_port_bytes + message.encode()
+            packet = offer.build_offer_packet(server_name, server_ip_address, server_tcp_port_number)
             # Send packet
             udp_socket.sendto(packet, (broadcast_ip, server_broadcast_port))
-            time.sleep(1)
+            # Wait for the next offer, waking up early if the lobby closes
+            next_offer += OFFER_INTERVAL
+            clock.wait(stop_event, next_offer - clock.now())
 
     except Exception as e:
         print(f"{Red}Failed sending UDP messages in the LAN via broadcast.")
         udp_socket.close()
 
 
-def run_udp_and_tcp_connections(server_ip_address, server_tcp_listening_port, server_udp_broadcast_port):
+def measure_rtt(player_name, client_socket, rtt_tracker, count):
+    """
+    Exchanges ping/pong frames with a client whose lobby has closed, to estimate its round-trip time.
+
+    Parameters:
+    - player_name (str): The name of the player associated with the client.
+    - client_socket (socket.socket): The socket object representing the client connection.
+    - rtt_tracker (rtt.RttTracker): Records the round-trip times.
+    - count (int): The number of pings to send.
+
+    Returns: None
+    """
+    try:
+        client_socket.settimeout(PING_TIMEOUT)
+        for i in range(count):
+            client_socket.sendall(rtt_tracker.ping(client_socket, player_name).encode())
+            data, pongs = rtt.strip_pongs(client_socket.recv(1024).decode())
+            for pong_sent_at in pongs:
+                rtt_tracker.record(client_socket, player_name, pong_sent_at)
+    except socket.timeout:
+        # A late pong is recorded by handle_client when it arrives
+        pass
+    except Exception as e:
+        # The player has left, this is handled once the game begins
+        pass
+    finally:
+        try:
+            client_socket.settimeout(None)
+        except Exception as e:
+            pass
+
+
+def run_udp_and_tcp_connections(server_ip_address, server_tcp_listening_port, server_udp_broadcast_port,
+                                clock=None, socket_factory=socket.socket, rtt_tracker=None, players_waiting=False,
+                                scheduler=None):
     """
     Establishes both UDP and TCP sockets in order to send offer messages and to accept clients connections, respectively.
     Parameters:
     - server_ip_address (str): The IP address of the server in the LAN.
     - server_tcp_listening_port (int): The TCP port number on which the server listens for incoming connections.
     - server_udp_broadcast_port (int): The UDP port number on which the server broadcasts offer messages.
+    - clock: The clock used by the offer broadcaster (see clock.py). Defaults to the wall clock.
+    - socket_factory: Callable used to create the TCP and UDP sockets. Defaults to socket.socket.
+    - rtt_tracker (rtt.RttTracker): Records the round-trip times of the players. Defaults to RTT_TRACKER.
+    - players_waiting (bool): Whether players from previous lobbies are still waiting to be matched, in which case
+      the lobby closes after LOBBY_TIMEOUT seconds even if nobody joins it, and after MAX_LOBBY_WHILE_WAITING
+      seconds even if players keep joining, since the waiting players are matched only once it closes.
+    - scheduler: Runs the round-trip time measurements of the players concurrently once the lobby closes
+      (see clock.py). Defaults to one thread per player.
 
     Returns:
-    - client_sockets (dict): A dictionary containing client sockets keyed by player names.
+    - players (list): (player name, client socket) tuples, in joining order. Several players may share a name;
+      the names are made unique for a game by matchmaking.unique_names, so every player keeps their own history.
     """
-    stop_event = threading.Event()  # Event to stop the UDP broadcast thread and TCP listening socket
+    if clock is None:
+        clock = SystemClock()
+    if rtt_tracker is None:
+        rtt_tracker = RTT_TRACKER
+    if scheduler is None:
+        scheduler = ThreadScheduler()
+    stop_event = clock.event()  # Event to stop the UDP broadcast thread and TCP listening socket
     try:
         # Create server TCP socket
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket = socket_factory(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((server_ip_address, server_tcp_listening_port))
         server_socket.listen(5)
         # Create server UDP socket & Start broadcasting offer messages in a separate thread
         offer_thread = threading.Thread(target=send_udp_broadcast_message, args=(
-            server_ip_address, server_udp_broadcast_port, server_tcp_listening_port, stop_event))
+            server_ip_address, server_udp_broadcast_port, server_tcp_listening_port, stop_event, clock, socket_factory))
         offer_thread.start()
-        # Dictionary to store client sockets
-        client_sockets = {}
+        # List to store the players and their client sockets
+        players = []
+        lobby_deadline = clock.now() + MAX_LOBBY_WHILE_WAITING
 
-        # Set a timer to stop sending UDP offers and break the loop after 10 seconds without action
+        # Set a timer to stop sending UDP offers and break the loop after LOBBY_TIMEOUT seconds without action
         try:
             # Accept client connections
             while not stop_event.is_set():
-                # If there is at least one player, start counting down 10 seconds for the joining of the next one.
-                if len(client_sockets) >= 1:
-                    server_socket.settimeout(10)  # Set timeout for accept() to 10 seconds
+                # If there is at least one player, start counting down LOBBY_TIMEOUT seconds for the joining of the next one.
+                if len(players) >= 1 or players_waiting:
+                    timeout = LOBBY_TIMEOUT
+                    if players_waiting:
+                        timeout = min(timeout, lobby_deadline - clock.now())
                     try:
+                        if timeout <= 0:
+                            raise socket.timeout("The players waiting to be matched have waited long enough")
+                        server_socket.settimeout(timeout)  # Set timeout for accept()
                         client_socket, addr = server_socket.accept()
                         server_socket.settimeout(None)  # Reset timeout
-                    # If the next player hasn't joined in 10 seconds, stop sending UDP messages and restart the process
+                    # If the next player hasn't joined in LOBBY_TIMEOUT seconds, stop sending UDP messages and restart the process
                     except socket.timeout:
                         stop_event.set()  # Stop sending UDP offers in order to begin the game
                         offer_thread.join()
                         server_socket.close()
-                        return client_sockets
+                        # Measure the round-trip times right before the game begins, off the accept path
+                        scheduler.run([(measure_rtt, (player_name, client_socket, rtt_tracker, PING_COUNT))
+                                       for player_name, client_socket in players])
+                        return players
                 else:
                     client_socket, addr = server_socket.accept()
 
                 player_name = client_socket.recv(1024).decode().strip()  # Receive player name from the client`
-                while True:
-                    if player_name in client_sockets.keys():
-                        fake = Faker()
-                        player_name = fake.name()
-                    else:
-                        client_sockets[player_name] = client_socket  # Add the client socket to the list]
-                        break
+                players.append((player_name, client_socket))  # Add the client socket to the list
 
         except Exception as e:
             print(f"{Red}Failed accepting new clients.")
             stop_event.set()
-            for client_socket in client_sockets.values():
+            for player_name, client_socket in players:
                 client_socket.close()
             server_socket.close()
 
     except Exception as e:
         print(f"Error trying to set a TCP server: {e}")
-        if len(client_sockets.keys()) > 0:
-            for client_socket in client_sockets.values():
+        if len(players) > 0:
+            for player_name, client_socket in players:
                 client_socket.close()
         server_socket.close()
 
 
+def parse_batch_answers(data, batch_size, max_elapsed=None):
+    """
+    Parses the answers of a client to a batch of questions.
+
+    Parameters:
+    - data (str): One line per question, each with the answer and the time in seconds, relative to when the
+      client received the batch, at which it was typed - e.g. "T 1.520". The answers are typed in order, so
+      the times may not decrease from one line to the next.
+    - batch_size (int): The number of questions in the batch.
+    - max_elapsed (float): The longest the client can have spent on the batch, as observed by the server.
+      Later timestamps are clamped to it, so a client cannot claim more time than it had. None to skip.
+
+    Returns: A list of (answer, timestamp) tuples, or None if the data is not a valid batch of answers.
+    """
+    lines = data.strip().splitlines()
+    if len(lines) != batch_size:
+        return None
+    batch_answers = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 2 or parts[0] not in VALID_ANSWERS:
+            return None
+        try:
+            timestamp = float(parts[1])
+        except ValueError:
+            return None
+        if not math.isfinite(timestamp) or timestamp < 0:
+            return None
+        if batch_answers and timestamp < batch_answers[-1][1]:
+            return None
+        if max_elapsed is not None:
+            timestamp = min(timestamp, max_elapsed)
+        batch_answers.append((parts[0], timestamp))
+    return batch_answers
+
+
 # Function to handle communication with each client
-def handle_client(player_name, client_socket, message, should_wait_for_answer, answers, dropouts):
+def handle_client(player_name, client_socket, message, should_wait_for_answer, answers, dropouts, rate_limiter=None,
+                  batch_size=1, rtt_tracker=None):
     """
     Handles communication with a client and applies input validation.
 
@@ -199,11 +304,21 @@ def handle_client(player_name, client_socket, message, should_wait_for_answer, a
     - client_socket (socket.socket): The socket object representing the client connection.
     - message (str): The message to send to the client.
     - should_wait_for_answer (bool): Indicates whether the function should wait for an answer from the client.
-    - answers (queue.Queue): A queue to store answers received from clients.
+    - answers (queue.Queue): A queue to store (player name, answer, question sent time, arrival time) tuples
+      received from clients.
     - dropouts (queue.Queue): A queue to store player names that have disconnected and should later be erased from the data structure.
+    - rate_limiter (rate_limit.RateLimiter): Limits the frames received from the client. Defaults to RATE_LIMITER.
+    - batch_size (int): The number of questions in the message. With more than one, the client answers them all
+      in one message (see parse_batch_answers) and a list of (answer, timestamp) tuples is put in answers.
+    - rtt_tracker (rtt.RttTracker): Records the round-trip time from the ping sent along with a question, and
+      provides the clock for the send and arrival times. Defaults to RTT_TRACKER.
 
     Returns: None
     """
+    if rate_limiter is None:
+        rate_limiter = RATE_LIMITER
+    if rtt_tracker is None:
+        rtt_tracker = RTT_TRACKER
     try:
 
         if not should_wait_for_answer:
@@ -213,19 +328,44 @@ def handle_client(player_name, client_socket, message, should_wait_for_answer, a
                 # Everybody left the game thus no socket is valid. Pass the exception and start a new game.
                 pass
         else:
-            valid_answers = ["Y", "T", "1", "N", "F", "0", "e"]
-            client_socket.sendall(message.encode())
+            # Piggyback a ping on the question, the client answers it before the question
+            sent_at = rtt_tracker.clock.now()
+            client_socket.sendall((rtt_tracker.ping(client_socket, player_name) + message).encode())
             while True:
                 # Receive data from the client
-                data = client_socket.recv(1024)
+                data = client_socket.recv(4096 if batch_size > 1 else 1024)
                 if data == 0:  # connection was closed, remove the player
                     dropouts.put(player_name)
                     return
-                if not data or data.decode() not in valid_answers: # Invalid answer, ask the player to change it
+                # Flooding clients are ignored, then muted, then disconnected
+                verdict = rate_limiter.check(client_socket)
+                if verdict == rate_limit.DISCONNECT:
+                    client_socket.close()
+                    dropouts.put(player_name)
+                    return
+                if verdict == rate_limit.DROP:
+                    continue
+                data, pongs = rtt.strip_pongs(data.decode())
+                # Kept apart from sent_at: the send time of the question must not come from what the client echoes
+                for pong_sent_at in pongs:
+                    rtt_tracker.record(client_socket, player_name, pong_sent_at)
+                if pongs and not data:
+                    continue
+                if batch_size > 1:
+                    # The client cannot have spent more than the time since the batch was sent, minus the round trip
+                    max_elapsed = max(0, rtt_tracker.clock.now() - sent_at - rtt_tracker.smoothed_rtt(client_socket))
+                    batch_answers = parse_batch_answers(data, batch_size, max_elapsed)
+                    if batch_answers is None:  # Invalid batch, ask the player to answer all the questions again
+                        error_message = f"Invalid batch, please answer all {batch_size} questions again, one per line"
+                        client_socket.sendall(error_message.encode())
+                    else:
+                        answers.put((player_name, batch_answers, sent_at, rtt_tracker.clock.now()))
+                        break
+                elif not data or data not in VALID_ANSWERS: # Invalid answer, ask the player to change it
                     error_message = "Invalid input, please answer again, Y/T/1 for 'True' or N/F/0 for 'False'"
                     client_socket.sendall(error_message.encode())  # Encode error message before sending
                 else:
-                    answers.put((player_name, data.decode()))
+                    answers.put((player_name, data, sent_at, rtt_tracker.clock.now()))
                     break
     except ConnectionResetError as e:
         # Player has quit the game
@@ -240,6 +380,23 @@ def handle_client(player_name, client_socket, message, should_wait_for_answer, a
         print("Goodbye.")
 
 
+def play_match(client_sockets, player_names, history):
+    """
+    Plays a trivia game between players matched by the matchmaking, and records its result in their history.
+
+    Parameters:
+    - client_sockets (dict): A dictionary containing client sockets keyed by the names shown in the game.
+    - player_names (dict): The names the history knows the players by, keyed by the names shown in the game.
+    - history (matchmaking.PlayerHistory): The history of the players, from which their skill is derived.
+
+    Returns: None
+    """
+    display_names = list(client_sockets.keys())
+    winner_name = game.trivia_game(client_sockets, batch_size=BATCH_SIZE, latency_compensation=LATENCY_COMPENSATION)
+    history.record_game([player_names[display_name] for display_name in display_names], player_names.get(winner_name))
+    print(f"{Yellow}Game over for {', '.join(display_names)}")
+
+
 def main():
     """
     Main function to start the server-side application.
@@ -248,30 +405,37 @@ def main():
     1. Retrieves the local IP address of the server.
     2. Determines a free port for UDP broadcasting and TCP listening.
     3. Runs UDP and TCP connections to handle client interactions.
-    4. If multiple clients join, starts a trivia game using the 'trivia_game' function from the 'game' module.
-    5. If only one client joins, sends a message indicating no other players have joined.
-    6. Handles exceptions that may occur during the execution, printing a failure message if an error occurs.
+    4. Puts the clients that joined in the matchmaking queue, which forms games of players with a similar skill.
+    5. Starts every game formed in its own thread, using the 'trivia_game' function from the 'game' module.
+    6. If a player waited too long without being matched, sends a message indicating no other players have joined.
+    7. Handles exceptions that may occur during the execution, printing a failure message if an error occurs.
 
     Note:
     - This function continuously runs in a loop to manage client connections and game sessions.
     - Any exception encountered during execution is caught and results in a failure message being printed.
     """
     try:
+        history = matchmaking.PlayerHistory()
+        matchmaking_queue = matchmaking.MatchmakingQueue(history)
         while True:
             server_ip_address = get_local_ip_address()
             server_udp_broadcast_port = 13117 # hard-coded, given in the instructions
             server_tcp_listening_port = get_free_port()
-            client_sockets = run_udp_and_tcp_connections(server_ip_address, server_tcp_listening_port,
-                                                         server_udp_broadcast_port)
-            if len(client_sockets) > 1:
-                game.trivia_game(client_sockets)
-                print(f"{Yellow}Game over, sending out offer requests...")
-
-            elif len(client_sockets) == 1:
-                message = f"{Red}No other players have joined, please try again."
-                for player_name, socket in client_sockets.items():
-                    handle_client(player_name, socket, message, False, None, None)
-                    socket.close()
+            players = run_udp_and_tcp_connections(server_ip_address, server_tcp_listening_port,
+                                                         server_udp_broadcast_port,
+                                                         players_waiting=len(matchmaking_queue) > 0)
+            for player_name, client_socket in players or []:
+                matchmaking_queue.add(player_name, client_socket)
+            for lobby, player_names in matchmaking_queue.poll():
+                if len(lobby) > 1:
+                    threading.Thread(target=play_match, args=(lobby, player_names, history)).start()
+
+                else:
+                    message = f"{Red}No other players have joined, please try again."
+                    for player_name, socket in lobby.items():
+                        handle_client(player_name, socket, message, False, None, None)
+                        socket.close()
+            print(f"{Yellow}{len(matchmaking_queue)} players waiting, sending out offer requests...")
 
     except Exception as e:
         print(f"{Red}Failed running the game")
@@ -0,0 +1,349 @@
+import argparse
+import contextlib
+import os
+import random
+import socket
+import tempfile
+import time
+
+import game
+import matchmaking
+import server
+from clock import VirtualClock, InlineScheduler
+from rate_limit import RateLimiter
+import rtt
+from rtt import RttTracker
+
+"""
+Simulation Mode for the Trivia Game Server
+
+This script plays complete games (lobby + trivia rounds) against simulated players,
+without any network and without waiting on real timeouts. It drives the real server
+code - run_udp_and_tcp_connections and trivia_game - with:
+1. A VirtualClock, so the 1-second offer cadence, the lobby timeout and the players'
+   answer times all pass instantly.
+2. An InlineScheduler, so every round runs on a single thread, in a shuffled order that
+   stands in for the order in which the answers would arrive.
+3. In-memory sockets in place of the TCP listener, the client connections and the UDP
+   broadcast socket.
+
+Simulated players answer randomly over links with different round-trip times, sometimes
+type invalid input, let the answer time run out or drop out of the game, which makes it a cheap way to fuzz the round and
+dropout logic and to estimate how long games take. Every message takes half a round trip
+to reach the player and every answer half a round trip to come back, so the simulation
+also counts how often the player who answered correctly the fastest won the game, with
+and without --latency-compensation.
+
+Usage: python simulation.py --games 1000 --players 4 --seed 1
+
+Author: Shir Mordechai Rozenfeld & Netta Meiri
+"""
+
+
+class SimulatedClient:
+    """
+    The server side of a connection to a simulated player. Implements the parts of
+    the socket API that the server uses: recv, sendall, settimeout and close.
+    """
+
+    def __init__(self, player_name, clock, rng, invalid_rate=0.05, timeout_rate=0.1, dropout_rate=0.02,
+                 round_trip_time=None):
+        self.player_name = player_name
+        self.clock = clock
+        self.rng = rng
+        # The typical round-trip time of the player's link, samples vary around it
+        self.round_trip_time = round_trip_time if round_trip_time is not None else rng.uniform(0.005, 0.5)
+        self.pings = []
+        self.invalid_rate = invalid_rate
+        self.timeout_rate = timeout_rate
+        self.dropout_rate = dropout_rate
+        self.name_sent = False
+        self.closed = False
+        self.questions = 0
+        self.messages = 0
+        self.batch_size = 1
+        # When the last message reaches the player
+        self.delivered_at = clock.now()
+        # The last question of a one-question round, and the answer typed to it with the time it took
+        self.question = None
+        self.answer = None
+
+    def link_delay(self):
+        """
+        Returns: The time a frame takes to travel one way over the player's link, half a round-trip time sample.
+        """
+        return self.round_trip_time * self.rng.uniform(0.8, 1.5) / 2
+
+    def arrive(self, delay):
+        """
+        Moves the clock to the time at which a frame sent delay seconds after the last message was delivered
+        reaches the server, unless the server has already moved past it.
+        """
+        self.clock.reset(max(self.clock.now(), self.delivered_at + delay + self.link_delay()))
+
+    def sendall(self, data):
+        if self.closed:
+            raise BrokenPipeError(f"{self.player_name} has left the game")
+        data, pings = rtt.strip_pings(data.decode())
+        self.pings += pings
+        if data or pings:
+            self.delivered_at = self.clock.now() + self.link_delay()
+        if data:
+            self.messages += 1
+        if game.BATCH_HEADER in data:
+            self.batch_size = data.count("True or false:")
+            self.questions += self.batch_size
+        elif "True or false: " in data:
+            self.questions += 1
+            self.question = data.split("True or false: ")[-1].splitlines()[0]
+            self.answer = None
+
+    def recv(self, bufsize):
+        if self.closed:
+            return b""
+        # The first thing a client sends is its name
+        if not self.name_sent:
+            self.name_sent = True
+            return (self.player_name + "\n").encode()
+        # Pings are answered before anything else
+        if self.pings:
+            self.arrive(0)
+            pongs = "".join(rtt.pong_frame(token) for token in self.pings)
+            self.pings = []
+            return pongs.encode()
+        # Otherwise the server is waiting for an answer
+        if self.rng.random() < self.dropout_rate:
+            self.closed = True
+            raise ConnectionResetError(f"{self.player_name} has quit the game")
+        if self.rng.random() < self.invalid_rate:
+            return b"?"
+        if self.batch_size > 1:
+            return self.answer_batch()
+        if self.rng.random() < self.timeout_rate:
+            self.arrive(server.ANSWER_TIMEOUT)
+            return b"e"
+        # The answer reaches the server half a round trip after it was typed
+        response_time = self.rng.uniform(0, server.ANSWER_TIMEOUT)
+        self.arrive(response_time)
+        self.answer = (self.rng.choice("YT1NF0"), response_time)
+        return self.answer[0].encode()
+
+    def answer_batch(self):
+        # Answers are typed one after the other, with 10 seconds per question for the whole batch
+        lines = []
+        elapsed = 0
+        for i in range(self.batch_size):
+            if self.rng.random() < self.timeout_rate:
+                elapsed = server.ANSWER_TIMEOUT * self.batch_size
+                lines += [f"e {elapsed:.3f}"] * (self.batch_size - i)
+                break
+            elapsed += self.rng.uniform(0, server.ANSWER_TIMEOUT)
+            lines.append(f"{self.rng.choice('YT1NF0')} {elapsed:.3f}")
+        self.arrive(elapsed)
+        return "\n".join(lines).encode()
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class InMemoryListener:
+    """
+    Stands in for the server's TCP listening socket. Players are queued with the
+    virtual time at which they connect, and accept() hands them out in that order,
+    honoring the timeout set by settimeout() on the virtual clock.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.pending = []
+        self.timeout = None
+
+    def connect(self, client, at):
+        self.pending.append((at, client))
+        self.pending.sort(key=lambda pending_client: pending_client[0])
+
+    def setsockopt(self, level, option, value):
+        pass
+
+    def bind(self, address):
+        pass
+
+    def listen(self, backlog):
+        pass
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def accept(self):
+        now = self.clock.now()
+        if self.timeout is not None and (not self.pending or self.pending[0][0] > now + self.timeout):
+            self.clock.advance(self.timeout)
+            raise socket.timeout("timed out")
+        if not self.pending:
+            # A real listener would block here forever
+            raise ConnectionAbortedError("No more simulated players")
+        at, client = self.pending.pop(0)
+        self.clock.reset(max(now, at))
+        return client, (client.player_name, 0)
+
+    def close(self):
+        pass
+
+
+class InMemoryUdpSocket:
+    """
+    Stands in for the UDP broadcast socket; offers are simply dropped.
+    """
+
+    def setsockopt(self, level, option, value):
+        pass
+
+    def bind(self, address):
+        pass
+
+    def sendto(self, packet, address):
+        pass
+
+    def close(self):
+        pass
+
+
+class SimulatedNetwork:
+    """
+    A socket factory handing out one in-memory TCP listener and UDP socket per lobby.
+    """
+
+    def __init__(self, clock):
+        self.listener = InMemoryListener(clock)
+        self.udp_socket = InMemoryUdpSocket()
+
+    def __call__(self, family, type):
+        if type == socket.SOCK_DGRAM:
+            return self.udp_socket
+        return self.listener
+
+
+def simulate_game(clock, rng, number_of_players, stats_path, rate_limiter, rtt_tracker, batch_size=1,
+                  latency_compensation=False, **client_options):
+    """
+    Runs one lobby and, if at least two players joined, one trivia game on virtual time.
+
+    Parameters:
+    - clock (VirtualClock): The virtual clock shared by the whole simulation.
+    - rng (random.Random): The source of randomness for the players and the answer order.
+    - number_of_players (int): The number of players trying to join the lobby.
+    - stats_path (str): The statistics file the game writes to.
+    - rate_limiter (RateLimiter): The rate limiter of the simulated server, on the virtual clock.
+    - rtt_tracker (RttTracker): The round-trip time estimates of the simulated server, on the virtual clock.
+    - batch_size (int): The number of questions sent in each round trip.
+    - latency_compensation (bool): Whether the server orders the answers by estimated response time.
+    - client_options: Passed on to SimulatedClient (invalid_rate, timeout_rate, dropout_rate, round_trip_time).
+
+    Returns:
+    - result (dict): The players that joined, the winner, whether the winner was the player who answered the last
+      question correctly the fastest (None for batched games and games nobody won), the number of questions,
+      the number of messages sent to the players and the virtual duration of the lobby and of the game.
+    """
+    network = SimulatedNetwork(clock)
+    start = clock.now()
+    arrival = start
+    for i in range(number_of_players):
+        network.listener.connect(SimulatedClient(f"player-{i + 1}", clock, rng, **client_options), arrival)
+        # Late players may miss the lobby
+        arrival += rng.uniform(0, server.LOBBY_TIMEOUT * 1.2)
+    players = server.run_udp_and_tcp_connections("127.0.0.1", 0, 0, clock, network, rtt_tracker,
+                                                 scheduler=InlineScheduler(clock, rng)) or []
+    client_sockets = matchmaking.unique_names(players)[0]
+    lobby_end = clock.now()
+    clients = list(client_sockets.values())
+    winner = None
+    fastest_won = None
+    if len(client_sockets) > 1:
+        winner = game.trivia_game(client_sockets, InlineScheduler(clock, rng), stats_path, rate_limiter, batch_size,
+                                  rtt_tracker, latency_compensation)
+    if winner is not None and batch_size == 1:
+        truth = {trivia_question["question"]: trivia_question["is_true"] for trivia_question in game.TRIVIA_QUESTIONS}
+        correct = [(client.answer[1], client.player_name) for client in clients
+                   if client.answer is not None and game.is_correct(client.answer[0], truth[client.question])]
+        fastest_won = min(correct)[1] == winner
+    return {
+        "players": len(clients),
+        "winner": winner,
+        "fastest_won": fastest_won,
+        "questions": max([client.questions for client in clients], default=0),
+        "messages": sum([client.messages for client in clients]),
+        "lobby_seconds": lobby_end - start,
+        "game_seconds": clock.now() - lobby_end,
+    }
+
+
+def simulate_games(number_of_games, number_of_players, seed=None, stats_path=None, batch_size=1,
+                   latency_compensation=False, **client_options):
+    """
+    Plays many complete games on virtual time and summarizes them.
+
+    Parameters:
+    - number_of_games (int): The number of games to play.
+    - number_of_players (int): The number of players trying to join each lobby.
+    - seed (int): Seed for the random number generators, to make a run reproducible.
+    - stats_path (str): The statistics file to use. It is truncated before every game so the
+      end-of-game summary stays cheap; defaults to a temporary file.
+    - batch_size (int): The number of questions sent in each round trip.
+    - latency_compensation (bool): Whether the server orders the answers by estimated response time.
+    - client_options: Passed on to SimulatedClient (invalid_rate, timeout_rate, dropout_rate, round_trip_time).
+
+    Returns:
+    - summary (dict): Totals over all the games, including the games won by the fastest correct player, and the
+      real time the simulation took.
+    """
+    rng = random.Random(seed)
+    # pick_a_question uses the global random module
+    random.seed(seed)
+    clock = VirtualClock()
+    rate_limiter = RateLimiter(clock)
+    rtt_tracker = RttTracker(clock)
+    summary = {"games": 0, "games_played": 0, "games_won": 0, "games_won_by_fastest": 0, "questions": 0, "messages": 0,
+               "virtual_seconds": 0.0, "real_seconds": 0.0}
+    real_start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        if stats_path is None:
+            stats_path = os.path.join(directory, game.STATS_FILE)
+        # The server prints every message it sends; keep the simulation quiet
+        with contextlib.redirect_stdout(devnull):
+            for _ in range(number_of_games):
+                open(stats_path, "w").close()
+                result = simulate_game(clock, rng, number_of_players, stats_path, rate_limiter, rtt_tracker,
+                                       batch_size, latency_compensation, **client_options)
+                summary["games"] += 1
+                summary["games_played"] += result["players"] > 1
+                summary["games_won"] += result["winner"] is not None
+                summary["games_won_by_fastest"] += result["fastest_won"] is True
+                summary["questions"] += result["questions"]
+                summary["messages"] += result["messages"]
+    summary["virtual_seconds"] = clock.now()
+    summary["real_seconds"] = time.perf_counter() - real_start
+    summary.update(rate_limiter.counts)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play trivia games against simulated players on virtual time.")
+    parser.add_argument("--games", type=int, default=1000, help="number of games to play")
+    parser.add_argument("--players", type=int, default=4, help="number of players trying to join each lobby")
+    parser.add_argument("--seed", type=int, default=None, help="seed for a reproducible run")
+    parser.add_argument("--batch-size", type=int, default=1, help="number of questions sent in each round trip")
+    parser.add_argument("--latency-compensation", action="store_true",
+                        help="order the answers by estimated response time instead of arrival time")
+    args = parser.parse_args()
+    summary = simulate_games(args.games, args.players, args.seed, batch_size=args.batch_size,
+                             latency_compensation=args.latency_compensation)
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    print(f"games per second: {summary['games'] / summary['real_seconds']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
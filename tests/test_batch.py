@@ -0,0 +1,48 @@
+from game import score_batch
+from server import parse_batch_answers
+
+
+def test_parse_batch_answers():
+    assert parse_batch_answers("T 1.520\nN 3.000\ne 20.000\n", 3) == [("T", 1.52), ("N", 3.0), ("e", 20.0)]
+
+
+def test_parse_batch_answers_rejects_malformed_batches():
+    assert parse_batch_answers("T 1.5", 2) is None
+    assert parse_batch_answers("T 1.5\nN 2\nY 3", 2) is None
+    assert parse_batch_answers("X 1.5\nN 2", 2) is None
+    assert parse_batch_answers("T\nN 2", 2) is None
+    assert parse_batch_answers("T soon\nN 2", 2) is None
+    assert parse_batch_answers("T nan\nN 2", 2) is None
+    assert parse_batch_answers("T inf\nN inf", 2) is None
+    assert parse_batch_answers("T -1\nN 2", 2) is None
+
+
+def test_parse_batch_answers_rejects_decreasing_timestamps():
+    assert parse_batch_answers("T 2\nN 1", 2) is None
+    assert parse_batch_answers("T 1\nN 1", 2) == [("T", 1.0), ("N", 1.0)]
+
+
+def test_parse_batch_answers_clamps_to_the_elapsed_time():
+    assert parse_batch_answers("T 1\nN 5\nY 9", 3, max_elapsed=4) == [("T", 1.0), ("N", 4), ("Y", 4)]
+    assert parse_batch_answers("T 1\nN 5", 2, max_elapsed=0) == [("T", 0), ("N", 0)]
+
+
+def test_score_batch_awards_each_question_to_the_earliest_correct_answer():
+    questions = [("Einstein was a vegetarian.", True), ("Einstein worked on the Manhattan Project.", False)]
+    batch_answers = [
+        ("alice", [("T", 2.0), ("T", 3.0)]),
+        ("bob", [("Y", 1.0), ("N", 4.0)]),
+        ("carol", [("N", 0.5), ("0", 5.0)]),
+    ]
+    points, question_winners, typed_characters = score_batch(questions, batch_answers)
+    assert question_winners == ["bob", "bob"]
+    assert points == {"alice": 0, "bob": 2, "carol": 0}
+    assert typed_characters == [["T", "Y", "N"], ["T", "N", "0"]]
+
+
+def test_score_batch_without_correct_answers():
+    questions = [("Einstein was a vegetarian.", True)]
+    batch_answers = [("alice", [("e", 10.0)]), ("bob", [("F", 1.0)])]
+    points, question_winners, typed_characters = score_batch(questions, batch_answers)
+    assert question_winners == [None]
+    assert points == {"alice": 0, "bob": 0}
@@ -0,0 +1,77 @@
+import random
+import threading
+from queue import Queue
+
+import pytest
+
+from clock import VirtualClock, InlineScheduler
+
+
+def wait_in_thread(clock, event, seconds):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("set", clock.wait(event, seconds)))
+    thread.start()
+    return thread, result
+
+
+def test_virtual_clock_wait_is_woken_by_set():
+    clock = VirtualClock()
+    event = clock.event()
+    thread, result = wait_in_thread(clock, event, 10)
+    event.set()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result["set"] is True
+    assert clock.now() == 0
+
+
+def test_virtual_clock_wait_times_out_when_the_clock_is_advanced():
+    clock = VirtualClock()
+    event = clock.event()
+    thread, result = wait_in_thread(clock, event, 10)
+    for i in range(500):
+        if not thread.is_alive():
+            break
+        clock.advance(10)
+        thread.join(0.01)
+    assert not thread.is_alive()
+    assert result["set"] is False
+
+
+def test_virtual_clock_sleep_advances_immediately():
+    clock = VirtualClock(start=5)
+    clock.sleep(2.5)
+    assert clock.now() == 7.5
+    clock.sleep(-1)
+    assert clock.now() == 7.5
+
+
+def put_after(clock, delay, name, queue):
+    clock.sleep(delay)
+    queue.put(name)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_inline_scheduler_delivers_puts_in_virtual_time_order(seed):
+    clock = VirtualClock()
+    queue = Queue()
+    delays = {"slow": 3, "fast": 1, "medium": 2}
+    InlineScheduler(clock, random.Random(seed)).run(
+        [(put_after, (clock, delay, name, queue)) for name, delay in delays.items()])
+    assert [queue.get() for i in range(3)] == ["fast", "medium", "slow"]
+    # The tasks ran in parallel: the clock stops at the slowest one
+    assert clock.now() == 3
+
+
+def test_inline_scheduler_delivers_puts_in_virtual_time_order_without_rng():
+    clock = VirtualClock()
+    queue = Queue()
+    InlineScheduler(clock).run([(put_after, (clock, 2, "first to run", queue)),
+                                (put_after, (clock, 1, "first to put", queue))])
+    assert [queue.get(), queue.get()] == ["first to put", "first to run"]
+
+
+def test_inline_scheduler_queues_are_put_only():
+    clock = VirtualClock()
+    with pytest.raises(AttributeError):
+        InlineScheduler(clock).run([(lambda queue: queue.get(), (Queue(),))])
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import random
+
+import matchmaking
+import server
+from clock import VirtualClock, InlineScheduler
+from matchmaking import PlayerHistory, MatchmakingQueue
+from rtt import RttTracker
+from simulation import SimulatedNetwork, SimulatedClient
+
+
+def make_queue(tmp_path, history_lines=()):
+    history_path = tmp_path / "players.txt"
+    history_path.write_text("".join(line + "\n" for line in history_lines))
+    history = PlayerHistory(str(history_path))
+    clock = VirtualClock()
+    return MatchmakingQueue(history, clock), clock
+
+
+def test_poll_matches_players_of_a_similar_skill(tmp_path):
+    # strong has won 9 of 9 games, weak has lost 9 of 9
+    history_lines = ["played:strong"] * 9 + ["won:strong"] * 9 + ["played:weak"] * 9
+    matchmaking_queue, clock = make_queue(tmp_path, history_lines)
+    for player_name in ["strong", "weak", "new-1", "new-2"]:
+        matchmaking_queue.add(player_name, object())
+    lobbies = matchmaking_queue.poll()
+    assert [sorted(lobby) for lobby, player_names in lobbies] == [["new-1", "new-2"]]
+    assert len(matchmaking_queue) == 2
+
+
+def test_poll_widens_the_skill_window_with_the_waiting_time(tmp_path):
+    history_lines = ["played:strong"] * 9 + ["won:strong"] * 9 + ["played:weak"] * 9
+    matchmaking_queue, clock = make_queue(tmp_path, history_lines)
+    matchmaking_queue.add("strong", object())
+    matchmaking_queue.add("weak", object())
+    assert matchmaking_queue.poll() == []
+    clock.advance(matchmaking.MAX_WAIT)
+    lobbies = matchmaking_queue.poll()
+    assert [sorted(lobby) for lobby, player_names in lobbies] == [["strong", "weak"]]
+    assert len(matchmaking_queue) == 0
+
+
+def test_poll_sends_a_lonely_player_home_after_max_wait(tmp_path):
+    matchmaking_queue, clock = make_queue(tmp_path)
+    client_socket = object()
+    matchmaking_queue.add("alone", client_socket)
+    assert matchmaking_queue.poll() == []
+    clock.advance(matchmaking.MAX_WAIT)
+    assert matchmaking_queue.poll() == [({"alone": client_socket}, {"alone": "alone"})]
+
+
+def test_poll_keeps_the_real_names_of_players_sharing_a_name(tmp_path):
+    matchmaking_queue, clock = make_queue(tmp_path)
+    first, second = object(), object()
+    matchmaking_queue.add("Netta", first)
+    matchmaking_queue.add("Netta", second)
+    [(lobby, player_names)] = matchmaking_queue.poll()
+    assert lobby == {"Netta": first, "Netta #2": second}
+    assert player_names == {"Netta": "Netta", "Netta #2": "Netta"}
+
+
+def test_poll_forms_games_of_at_most_max_players(tmp_path):
+    matchmaking_queue, clock = make_queue(tmp_path)
+    for i in range(matchmaking.MAX_PLAYERS + 2):
+        matchmaking_queue.add(f"player-{i}", object())
+    lobbies = matchmaking_queue.poll()
+    assert [len(lobby) for lobby, player_names in lobbies] == [matchmaking.MAX_PLAYERS, 2]
+
+
+def test_record_game_updates_the_skill(tmp_path):
+    matchmaking_queue, clock = make_queue(tmp_path)
+    history = matchmaking_queue.history
+    assert history.skill("alice") == 0.5
+    history.record_game(["alice", "bob"], "alice")
+    assert history.skill("alice") == 2 / 3
+    assert history.skill("bob") == 1 / 3
+    # The history file is read back by the next server
+    assert PlayerHistory(history.history_path).skill("alice") == 2 / 3
+
+
+def test_unique_names():
+    first, second, third = object(), object(), object()
+    client_sockets, player_names = matchmaking.unique_names([("Netta", first), ("Shir", second), ("Netta", third)])
+    assert client_sockets == {"Netta": first, "Shir": second, "Netta #2": third}
+    assert player_names == {"Netta": "Netta", "Shir": "Shir", "Netta #2": "Netta"}
+
+
+def test_players_sharing_a_name_in_one_lobby_keep_their_history(tmp_path):
+    matchmaking_queue, clock = make_queue(tmp_path)
+    network = SimulatedNetwork(clock)
+    rng = random.Random(0)
+    for at in [0, 1]:
+        network.listener.connect(SimulatedClient("Netta", clock, rng), at)
+    with contextlib.redirect_stdout(io.StringIO()):
+        players = server.run_udp_and_tcp_connections("127.0.0.1", 0, 0, clock, network, RttTracker(clock),
+                                                     scheduler=InlineScheduler(clock, rng))
+    assert [player_name for player_name, client_socket in players] == ["Netta", "Netta"]
+    for player_name, client_socket in players:
+        matchmaking_queue.add(player_name, client_socket)
+    [(lobby, player_names)] = matchmaking_queue.poll()
+    matchmaking_queue.history.record_game([player_names[display_name] for display_name in lobby], None)
+    assert matchmaking_queue.history.played == {"Netta": 2}
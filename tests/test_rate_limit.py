@@ -0,0 +1,92 @@
+import rate_limit
+from clock import VirtualClock
+from rate_limit import TokenBucket, RateLimiter, ALLOW, DROP, DISCONNECT
+
+
+class FakeSocket:
+    pass
+
+
+def test_token_bucket_allows_a_burst_then_refills():
+    bucket = TokenBucket(rate=2, capacity=3, now=0)
+    assert [bucket.consume(0) for i in range(4)] == [True, True, True, False]
+    # Half a second at 2 tokens per second buys one more frame
+    assert bucket.consume(0.5)
+    assert not bucket.consume(0.5)
+
+
+def test_token_bucket_never_holds_more_than_its_capacity():
+    bucket = TokenBucket(rate=2, capacity=3, now=0)
+    assert [bucket.consume(100) for i in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_reserve_returns_the_time_until_the_token_is_available():
+    bucket = TokenBucket(rate=4, capacity=1, now=0)
+    assert bucket.reserve(0, 1) == 0
+    assert bucket.reserve(0, 1) == 0.25
+    assert bucket.reserve(0, 1) == 0.5
+
+
+def test_token_bucket_reserve_refuses_a_wait_longer_than_max_wait():
+    bucket = TokenBucket(rate=4, capacity=1, now=0)
+    assert [bucket.reserve(0, 0.5) for i in range(4)] == [0, 0.25, 0.5, None]
+    # The refused frame took no token, so the debt did not grow
+    assert bucket.reserve(0.25, 0.5) == 0.5
+
+
+def test_check_escalates_from_drop_to_mute_to_disconnect():
+    clock = VirtualClock()
+    rate_limiter = RateLimiter(clock)
+    client_socket = FakeSocket()
+    verdicts = [rate_limiter.check(client_socket) for i in range(rate_limit.CONNECTION_BURST)]
+    assert verdicts == [ALLOW] * rate_limit.CONNECTION_BURST
+
+    verdicts = [rate_limiter.check(client_socket) for i in range(rate_limit.MUTE_AFTER)]
+    assert verdicts == [DROP] * rate_limit.MUTE_AFTER
+    assert rate_limiter.counts["muted"] == 1
+
+    # Muted: frames are dropped even once the bucket has refilled
+    clock.advance(rate_limit.MUTE_SECONDS / 2)
+    assert rate_limiter.check(client_socket) == DROP
+
+    verdicts = [rate_limiter.check(client_socket)
+                for i in range(rate_limit.DISCONNECT_AFTER - rate_limit.MUTE_AFTER - 1)]
+    assert verdicts[-1] == DISCONNECT
+    assert verdicts[:-1] == [DROP] * (len(verdicts) - 1)
+    assert rate_limiter.counts["disconnected"] == 1
+
+
+def test_check_allows_again_after_the_mute():
+    clock = VirtualClock()
+    rate_limiter = RateLimiter(clock)
+    client_socket = FakeSocket()
+    for i in range(rate_limit.CONNECTION_BURST + rate_limit.MUTE_AFTER):
+        rate_limiter.check(client_socket)
+    clock.advance(rate_limit.MUTE_SECONDS)
+    assert rate_limiter.check(client_socket) == ALLOW
+
+
+def test_check_delays_instead_of_dropping_when_the_global_bucket_is_empty():
+    clock = VirtualClock()
+    rate_limiter = RateLimiter(clock)
+    rate_limiter.global_bucket = TokenBucket(rate=10, capacity=1, now=0)
+    sockets = [FakeSocket() for i in range(3)]
+    assert [rate_limiter.check(client_socket) for client_socket in sockets] == [ALLOW] * 3
+    # The two frames over the global burst waited for their tokens
+    assert rate_limiter.counts["delayed_global"] == 2
+    assert rate_limiter.counts["dropped"] == 0
+    assert clock.now() > 0
+
+
+def test_check_drops_without_penalty_when_the_global_wait_is_too_long():
+    clock = VirtualClock()
+    rate_limiter = RateLimiter(clock)
+    rate_limiter.global_bucket = TokenBucket(rate=1, capacity=1, now=0)
+    client_socket = FakeSocket()
+    assert rate_limiter.check(client_socket) == ALLOW
+    # The next token is a whole second away, longer than MAX_GLOBAL_WAIT
+    assert rate_limit.MAX_GLOBAL_WAIT < 1
+    assert rate_limiter.check(FakeSocket()) == DROP
+    assert rate_limiter.counts["dropped_global"] == 1
+    assert rate_limiter.counts["dropped"] == 0
+    assert clock.now() == 0
@@ -0,0 +1,152 @@
+from queue import Queue
+
+import pytest
+
+import rtt
+import server
+from clock import VirtualClock, InlineScheduler
+from game import receive_answers
+from rate_limit import RateLimiter
+from rtt import RttTracker
+
+
+class ScriptedSocket:
+    """
+    A client connection that sends the given frames, each after the given number of seconds of virtual time.
+    """
+
+    def __init__(self, clock, frames=()):
+        self.clock = clock
+        self.frames = list(frames)
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data.decode())
+
+    def recv(self, bufsize):
+        delay, data = self.frames.pop(0)
+        self.clock.advance(delay)
+        return data
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+def sample(rtt_tracker, client_socket, seconds):
+    """
+    Pings a connection and records its pong after the given number of seconds.
+    """
+    data, [token] = rtt.strip_pings(rtt_tracker.ping(client_socket, "player"))
+    rtt_tracker.clock.advance(seconds)
+    rtt_tracker.record(client_socket, "player", float(token))
+
+
+def test_strip_pings_and_pongs():
+    data, pings = rtt.strip_pings(rtt.ping_frame(1.5) + "True or false: ?" + rtt.ping_frame(2))
+    assert data == "True or false: ?"
+    assert pings == ["1.500000", "2.000000"]
+    data, pongs = rtt.strip_pongs("".join(rtt.pong_frame(token) for token in pings) + "T")
+    assert data == "T"
+    assert pongs == [1.5, 2.0]
+    assert rtt.strip_pongs("<PONG x>T") == ("<PONG x>T", [])
+
+
+def test_smoothed_rtt_and_jitter_follow_rfc_6298():
+    clock = VirtualClock()
+    rtt_tracker = RttTracker(clock)
+    client_socket = ScriptedSocket(clock)
+    assert rtt_tracker.smoothed_rtt(client_socket) == 0
+    sample(rtt_tracker, client_socket, 0.1)
+    assert rtt_tracker.smoothed_rtt(client_socket) == pytest.approx(0.1)
+    assert rtt_tracker.distribution(client_socket)["jitter"] == pytest.approx(0.05)
+    sample(rtt_tracker, client_socket, 0.2)
+    assert rtt_tracker.smoothed_rtt(client_socket) == pytest.approx(7 / 8 * 0.1 + 1 / 8 * 0.2)
+    assert rtt_tracker.distribution(client_socket)["jitter"] == pytest.approx(3 / 4 * 0.05 + 1 / 4 * 0.1)
+
+
+def test_distribution_percentiles():
+    clock = VirtualClock()
+    rtt_tracker = RttTracker(clock)
+    client_socket = ScriptedSocket(clock)
+    assert rtt_tracker.distribution(client_socket) is None
+    for i in [7, 3, 10, 1, 5, 9, 2, 8, 4, 6]:
+        sample(rtt_tracker, client_socket, i / 100)
+    distribution = rtt_tracker.distribution(client_socket)
+    assert distribution["samples"] == 10
+    assert distribution["min"] == pytest.approx(0.01)
+    assert distribution["median"] == pytest.approx(0.06)
+    assert distribution["p90"] == pytest.approx(0.10)
+    assert distribution["max"] == pytest.approx(0.10)
+
+
+def test_record_ignores_pongs_of_pings_that_were_not_sent():
+    clock = VirtualClock(start=1000)
+    rtt_tracker = RttTracker(clock)
+    client_socket = ScriptedSocket(clock, [(0.05, b"<PONG 0.000001>")] * server.PING_COUNT)
+    server.measure_rtt("cheater", client_socket, rtt_tracker, server.PING_COUNT)
+    assert rtt_tracker.smoothed_rtt(client_socket) == 0
+    assert rtt_tracker.distribution(client_socket) is None
+
+
+def test_record_takes_every_pong_once_and_caps_the_sample():
+    clock = VirtualClock()
+    rtt_tracker = RttTracker(clock, max_sample=1)
+    client_socket = ScriptedSocket(clock)
+    data, [token] = rtt.strip_pings(rtt_tracker.ping(client_socket, "player"))
+    clock.advance(30)
+    rtt_tracker.record(client_socket, "player", float(token))
+    rtt_tracker.record(client_socket, "player", float(token))
+    assert rtt_tracker.distribution(client_socket)["samples"] == 1
+    assert rtt_tracker.smoothed_rtt(client_socket) == 1
+
+
+def play_round(clock, rtt_tracker, client_sockets, latency_compensation):
+    """
+    Sends a question to every client and returns the players in the order the server ranks their answers.
+    """
+    answers = Queue()
+    InlineScheduler(clock).run([(server.handle_client, (player_name, client_socket, "True or false: ?", True, answers,
+                                                        Queue(), RateLimiter(clock), 1, rtt_tracker))
+                                for player_name, client_socket in client_sockets.items()])
+    return [player_answer[0] for player_answer in receive_answers(answers, client_sockets, rtt_tracker,
+                                                                    latency_compensation)]
+
+
+def test_receive_answers_compensates_the_whole_round_trip():
+    clock = VirtualClock()
+    rtt_tracker = RttTracker(clock)
+    far = ScriptedSocket(clock, [(1.8, b"T")])
+    near = ScriptedSocket(clock, [(1.2, b"T")])
+    sample(rtt_tracker, far, 0.8)
+    sample(rtt_tracker, near, 0.01)
+    clock.reset(10)
+    client_sockets = {"far": far, "near": near}
+    # far took 1 second to answer once its round trip is taken off, near took 1.19 seconds
+    assert play_round(clock, rtt_tracker, dict(client_sockets), True) == ["far", "near"]
+    far.frames, near.frames = [(1.8, b"T")], [(1.2, b"T")]
+    assert play_round(clock, rtt_tracker, dict(client_sockets), False) == ["near", "far"]
+
+
+def test_a_forged_pong_does_not_change_the_question_send_time():
+    clock = VirtualClock()
+    rtt_tracker = RttTracker(clock)
+    client_sockets = {
+        "cheater": ScriptedSocket(clock, [(4, b"<PONG 99999999.0>T")]),
+        "honest": ScriptedSocket(clock, [(1, b"T")]),
+    }
+    assert play_round(clock, rtt_tracker, client_sockets, True) == ["honest", "cheater"]
+
+
+def test_a_late_lobby_pong_does_not_penalize_the_player():
+    clock = VirtualClock(start=100)
+    rtt_tracker = RttTracker(clock)
+    late = ScriptedSocket(clock)
+    # The lobby ping is never answered in time, its pong arrives along with the answer
+    data, [token] = rtt.strip_pings(rtt_tracker.ping(late, "late"))
+    clock.reset(110)
+    late.frames = [(1, f"<PONG {token}>T".encode())]
+    client_sockets = {"late": late, "other": ScriptedSocket(clock, [(2, b"T")])}
+    assert play_round(clock, rtt_tracker, client_sockets, True) == ["late", "other"]
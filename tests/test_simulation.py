@@ -0,0 +1,20 @@
+from simulation import simulate_games
+
+
+def test_simulate_games_is_reproducible():
+    first = simulate_games(50, 4, seed=1)
+    second = simulate_games(50, 4, seed=1)
+    assert first["games"] == 50
+    assert 0 < first["games_played"] <= 50
+    assert first["games_won_by_fastest"] <= first["games_won"] <= first["games_played"]
+    assert first["questions"] > 0
+    for key in first:
+        if key != "real_seconds":
+            assert first[key] == second[key], key
+
+
+def test_simulate_games_with_batches_and_latency_compensation():
+    summary = simulate_games(30, 3, seed=2, batch_size=3, latency_compensation=True)
+    assert summary["games"] == 30
+    assert summary["games_won"] > 0
+    assert summary["questions"] >= 3 * summary["games_played"]